@@ -1,32 +1,56 @@
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from datetime import datetime
 import uuid
-from dotenv import load_dotenv
-
-# services
-from services.supabase_client import supabase
-from services.storage import upload_audio_base64
-from services.utils import calculate_phq8_score_and_severity
-
-load_dotenv()
+import json
+import logging
+from urllib.parse import urlencode
+
+# services (services.supabase_client loads .env, so it is imported first)
+from services.supabase_client import get_supabase
+from services.circuit import CircuitOpen, supabase_breaker
+from services.health import health_check
+from services.storage import (
+    upload_audio_base64, upload_audio_stream, upload_audio_file, attach_audio_urls, stored_audio_path, audio_exists,
+    content_storage_path,
+)
+from services.submissions import validate_submission, build_record, assessment_id_for, SHA256_HEX
+from services.aggregates import stats_aggregate
+from services.stats_stream import stats_hub, TooManySubscribers, HEADERS as STREAM_HEADERS
+from services.analytics import analytics_snapshot, parse_bound, DIMENSIONS as ANALYTICS_DIMENSIONS, MAX_GROUP_BY
+from services.upload_queue import upload_queue, UPLOAD_MODE
+from services.upload_sessions import upload_sessions, UploadNotFound, UploadIncomplete, OffsetMismatch
+from services.queries import ASSESSMENT_COLUMNS, parse_fields, parse_offset, encode_cursor, decode_cursor, fetch_assessment_page
+from services.cache import cache, cached_json, invalidate_assessment
+from services.export import export_chunks, CONTENT_TYPES as EXPORT_CONTENT_TYPES
+from services.batch import process_batch, BATCH_MAX_ITEMS
+from services import metrics, admission
+from services.metrics import span, metrics_response
+from services.admission import PayloadTooLarge, too_large_response
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-# Configure CORS for production
+metrics.init_app(app)
+admission.init_app(app)
+# Configure CORS for production (asgi.py applies the same settings)
+CORS_ORIGINS = [
+    "http://localhost:3000",
+    "https://fydp-2-website-dataset-detection.vercel.app",
+    "https://*.vercel.app"
+]
+CORS_METHODS = ["GET", "POST", "PATCH", "HEAD", "OPTIONS"]
+CORS_ALLOW_HEADERS = ["Content-Type", "X-Assessment-Metadata", "X-Audio-Content-Type", "If-None-Match", "Idempotency-Key",
+                      "Upload-Offset", "Upload-Length"]
+CORS_EXPOSE_HEADERS = ["ETag", "Server-Timing", "Retry-After", "Upload-Offset", "Upload-Length", "Location"]
 CORS(app, resources={
     r"/api/*": {
-        "origins": [
-            "http://localhost:3000",
-            "https://fydp-2-website-dataset-detection.vercel.app",
-            "https://*.vercel.app"
-        ],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"],
+        "origins": CORS_ORIGINS,
+        "methods": CORS_METHODS,
+        "allow_headers": CORS_ALLOW_HEADERS,
+        "expose_headers": CORS_EXPOSE_HEADERS,
         "supports_credentials": True
     }
 })
@@ -34,6 +58,8 @@ CORS(app, resources={
 # config
 ASSESSMENTS_TABLE = os.getenv("ASSESSMENTS_TABLE", "voice_assessments")
 PORT = int(os.getenv("PORT", 5000))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+MAX_PAGE_SIZE = int(os.getenv("ASSESSMENTS_MAX_PAGE_SIZE", 200))
 
 
 def _safe_get_response_data(res):
@@ -54,20 +80,36 @@ def index():
         "endpoints": {
             "/api/health": "GET",
             "/api/stats": "GET",
+            "/api/stats/stream": "GET (text/event-stream)",
+            "/api/stats/rebuild": "POST",
+            "/api/analytics": "GET",
             "/api/submit_test": "POST",
+            "/api/submit_batch": "POST",
+            "/api/audio/<sha256>": "GET",
+            "/api/uploads": "POST",
+            "/api/uploads/<id>": "HEAD, PATCH",
+            "/api/uploads/<id>/finalize": "POST",
             "/api/assessment/<id>": "GET",
-            "/api/assessments": "GET"
+            "/api/assessments": "GET",
+            "/api/export": "GET",
+            "/api/cache/stats": "GET",
+            "/api/metrics": "GET"
         }
     })
 
 
+def _unavailable(e: CircuitOpen):
+    """503 while Supabase calls are failing fast (services/circuit.py)."""
+    resp = jsonify({"error": "service_unavailable", "retryAfter": e.retry_after})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 503
+
+
 @app.route("/api/health")
 def health():
-    try:
-        res = supabase.table(ASSESSMENTS_TABLE).select("id", count="exact").limit(1).execute()
-        return jsonify({"status": "healthy", "db": "connected", "timestamp": datetime.utcnow().isoformat()}), 200
-    except Exception as e:
-        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+    """Last result of a periodic one-row probe (services/health.py), not a query per call."""
+    result = health_check.get()
+    return jsonify(result), 200 if result["status"] == "healthy" else 500
 
 
 # @app.route("/api/stats")
@@ -144,200 +186,597 @@ def health():
 
 @app.route('/api/stats')
 def get_stats():
+    def produce():
+        with span("stats_refresh"):
+            stats_aggregate.refresh()
+        return stats_aggregate.to_response(), 200
+
     try:
-        response = supabase.table('voice_assessments').select('*').execute()
-        data = response.data or []
-
-        total_tests = len(data)
-        total_audio = sum(1 for d in data if d.get('audioData') or d.get('audio_path'))
-        avg_phq8 = (
-            sum(d.get('phq8_total_score', 0) for d in data) / total_tests
-            if total_tests > 0 else 0
-        )
-
-        # --- Gender Ratio ---
-        male = sum(1 for d in data if (d.get('gender') or '').lower() == 'male')
-        female = sum(1 for d in data if (d.get('gender') or '').lower() == 'female')
-        male_percent = round((male / total_tests) * 100, 1) if total_tests > 0 else 0
-        female_percent = round((female / total_tests) * 100, 1) if total_tests > 0 else 0
-
-        # --- Severity Distribution ---
-        severity_counts = {"minimal": 0, "mild": 0, "moderate": 0, "moderately-severe": 0, "severe": 0}
-        for d in data:
-            sev = (d.get("severity") or "").lower()
-            if sev in severity_counts:
-                severity_counts[sev] += 1
-
-        status_distribution = [
-            {"name": "সর্বনিম্ন (0-4)", "value": round((severity_counts["minimal"] / total_tests) * 100, 1) if total_tests > 0 else 0},
-            {"name": "সামান্য (5-9)", "value": round((severity_counts["mild"] / total_tests) * 100, 1) if total_tests > 0 else 0},
-            {"name": "মাঝারি (10-14)", "value": round((severity_counts["moderate"] / total_tests) * 100, 1) if total_tests > 0 else 0},
-            {"name": "মাঝারি থেকে গুরুতর (15-19)", "value": round((severity_counts["moderately-severe"] / total_tests) * 100, 1) if total_tests > 0 else 0},
-            {"name": "গুরুতর (20-24)", "value": round((severity_counts["severe"] / total_tests) * 100, 1) if total_tests > 0 else 0},
-        ]
-
-        # --- Age Distribution ---
-        age_groups = {"18-24": 0, "25-34": 0, "35-44": 0, "45-54": 0, "55+": 0}
-        for d in data:
-            try:
-                age = int(d.get("age", 0))
-            except:
-                continue
-            if 18 <= age <= 24:
-                age_groups["18-24"] += 1
-            elif 25 <= age <= 34:
-                age_groups["25-34"] += 1
-            elif 35 <= age <= 44:
-                age_groups["35-44"] += 1
-            elif 45 <= age <= 54:
-                age_groups["45-54"] += 1
-            else:
-                age_groups["55+"] += 1
-
-        age_distribution = [{"ageGroup": k, "count": v} for k, v in age_groups.items()]
-
-        return jsonify({
-            "totalTests": total_tests,
-            "totalAudio": total_audio,
-            "averagePhq8": round(avg_phq8, 2),
-            "malePercent": male_percent,
-            "femalePercent": female_percent,
-            "statusDistribution": status_distribution,
-            "ageDistribution": age_distribution
-        })
+        return cached_json("stats", produce)
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("error fetching stats")
+        metrics.record_error()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/stats/stream")
+def stream_stats():
+    """
+    Server-Sent Events: the /api/stats payload once, then deltas as
+    submissions land (services/stats_stream.py). Each connection holds a
+    thread here, so this answers 503 unless STATS_STREAM_WSGI_MAX_SUBSCRIBERS
+    is set; asgi.py serves this route without one.
+    """
+    try:
+        events, release = stats_hub.wsgi_events()
+    except TooManySubscribers:
+        resp = jsonify({"error": "too_many_subscribers", "retryAfter": 30})
+        resp.headers["Retry-After"] = "30"
+        return resp, 503
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("error opening stats stream")
+        metrics.record_error()
+        return jsonify({"error": str(e)}), 500
+    resp = Response(events, mimetype="text/event-stream", headers=STREAM_HEADERS)
+    resp.call_on_close(release)
+    return resp
+
+
+@app.route("/api/stats/rebuild", methods=["POST"])
+def rebuild_stats():
+    """Operator hook: drop the running counters and the analytics snapshot and rescan the table."""
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "forbidden"}), 403
+    try:
+        stats_aggregate.rebuild()
+        stats_hub.notify()
+        analytics_snapshot.rebuild()
+        cache.delete("stats")
+        cache.delete_prefix("analytics:")
+        return jsonify(stats_aggregate.to_response()), 200
+    except CircuitOpen as e:
+        return _unavailable(e)
     except Exception as e:
-        print("Error fetching stats:", e)
+        logger.exception("error rebuilding stats")
+        metrics.record_error()
         return jsonify({"error": str(e)}), 500
 
 
+def _analytics_params(args):
+    """Parse /api/analytics query params into AnalyticsSnapshot.query() kwargs; raises ValueError."""
+    group_by = [d.strip() for d in args.get("group_by", "").split(",") if d.strip()]
+    unknown = [d for d in group_by if d not in ANALYTICS_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"unknown group_by: {', '.join(unknown)}")
+    if len(group_by) > MAX_GROUP_BY or len(set(group_by)) != len(group_by):
+        raise ValueError(f"group_by takes up to {MAX_GROUP_BY} distinct dimensions")
+    filters = {d: args.get(d).split(",") for d in ANALYTICS_DIMENSIONS if args.get(d)}
+    return {
+        "filters": filters,
+        "group_by": group_by,
+        "date_from": parse_bound(args["from"]) if args.get("from") else None,
+        "date_to": parse_bound(args["to"], end=True) if args.get("to") else None,
+        "age_min": int(args["age_min"]) if args.get("age_min") else None,
+        "age_max": int(args["age_max"]) if args.get("age_max") else None,
+    }
+
+
+@app.route("/api/analytics")
+def analytics():
+    """
+    Filtered group-by / cross-tab over the in-memory snapshot (services/analytics.py);
+    the database is only read to catch up with new rows.
+    Query params:
+    - group_by: up to two of gender, language_dialect, recording_environment,
+      current_medication, severity, age_group (two give a cross-tab)
+    - <dimension>=a,b: keep rows whose value is one of the labels
+    - from, to: created_at range, ISO date or datetime (inclusive)
+    - age_min, age_max
+    """
+    def produce():
+        try:
+            params = _analytics_params(request.args)
+        except ValueError as e:
+            return {"error": "invalid_params", "details": str(e)}, 400
+        with span("analytics_refresh"):
+            analytics_snapshot.refresh()
+        try:
+            with span("analytics_query"):
+                return analytics_snapshot.query(**params), 200
+        except ValueError as e:
+            return {"error": "invalid_params", "details": str(e)}, 400
+
+    try:
+        key = "analytics:" + urlencode(sorted(request.args.items(multi=True)))
+        return cached_json(key, produce)
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("error running analytics query")
+        metrics.record_error()
+        return jsonify({"error":"server_error","details": str(e)}), 500
+
+
+def _read_submission():
+    """
+    Split the request into (metadata dict, audio source). The audio source is
+    None for the JSON/base64 contract, otherwise (file-like, content_type)
+    that can be streamed straight to storage.
+    """
+    mimetype = request.mimetype or ""
+    if mimetype == "multipart/form-data":
+        if "metadata" in request.form:
+            data = json.loads(request.form["metadata"])
+        else:
+            data = request.form.to_dict()
+            for key in ("consent", "consentData"):
+                if isinstance(data.get(key), str):
+                    data[key] = json.loads(data[key])
+        audio = request.files.get("audio")
+        if audio is None:
+            return data, None
+        return data, (audio.stream, audio.mimetype or "audio/webm")
+
+    if mimetype == "application/octet-stream" or mimetype.startswith("audio/"):
+        # header only: fields in a query string would end up in access logs
+        raw = request.headers.get("X-Assessment-Metadata")
+        data = json.loads(raw) if raw else None
+        content_type = mimetype if mimetype.startswith("audio/") else request.headers.get("X-Audio-Content-Type", "audio/webm")
+        return data, (request.stream, content_type)
+
+    return request.get_json(silent=True), None
+
+
+class InvalidAudio(Exception):
+    pass
+
+
+class AudioNotFound(Exception):
+    """audioSha256 names a recording that is not in storage and no bytes were sent."""
+
+
+class DuplicateSubmission(Exception):
+    """The idempotency key's row already exists; carries the original response body."""
+
+    def __init__(self, result: dict):
+        super().__init__(result["testId"])
+        self.result = result
+
+
+def submission_result(row: dict) -> dict:
+    return {
+        "testId": row["id"],
+        "status": row["status"],
+        "phq8Score": row["phq8_total_score"],
+        "severity": row["severity"]
+    }
+
+
+def _existing_submission(aid):
+    with span("db_query"):
+        res = get_supabase().table(ASSESSMENTS_TABLE).select("id,status,phq8_total_score,severity").eq("id", aid).execute()
+    rows = _safe_get_response_data(res) or []
+    return submission_result(rows[0]) if rows else None
+
+
+def _insert(record: dict, idempotent: bool):
+    try:
+        with span("db_insert"):
+            get_supabase().table(ASSESSMENTS_TABLE).insert(record).execute()
+    except Exception:
+        # a concurrent retry with the same key inserted first
+        existing = _existing_submission(record["id"]) if idempotent else None
+        if existing:
+            raise DuplicateSubmission(existing)
+        raise
+
+
+def _submit_with_stored_audio(aid, data, cleaned, idempotent):
+    """audioSha256 without audioData: reference the recording uploaded by an earlier attempt."""
+    storage_path = stored_audio_path(data["audioSha256"])
+    if not storage_path:
+        raise AudioNotFound()
+    record = build_record(aid, data, cleaned, storage_path)
+    _insert(record, idempotent)
+    return record
+
+
+def _submit_with_upload_session(aid, data, cleaned, idempotent):
+    """
+    audioUploadId: the recording is already on local disk. Reuse a stored copy
+    with the same hash if there is one; otherwise upload it now (sync mode)
+    or move it into the upload queue's spool (async mode, or if that fails).
+    """
+    sid = data["audioUploadId"]
+    session = upload_sessions.finalized(sid)
+    if data.get("audioSha256") and data["audioSha256"] != session["sha256"]:
+        raise InvalidAudio()
+    content_type = session["content_type"]
+    storage_path = stored_audio_path(session["sha256"])
+    if storage_path is None and UPLOAD_MODE != "async":
+        try:
+            storage_path = upload_audio_file(upload_sessions.data_path(sid), content_type)
+        except Exception:
+            logger.exception("audio upload error for %s, spooling", aid)
+
+    record = build_record(aid, data, cleaned, storage_path, status="submitted" if storage_path else "audio_pending")
+    # on failure the session is left as is, so a retry can still use it
+    _insert(record, idempotent)
+    if storage_path is None:
+        upload_sessions.move_data(sid, upload_queue.spool_path(aid))
+        upload_queue.submit(aid, content_type)
+    upload_sessions.discard(sid)
+    return record
+
+
+def _submit_with_inline_audio(aid, data, cleaned, audio_source, idempotent):
+    """Upload the recording before inserting the row (AUDIO_UPLOAD_MODE=sync)."""
+    storage_path = None
+    try:
+        if audio_source is not None:
+            stream, content_type = audio_source
+            storage_path = upload_audio_stream(aid, stream, content_type)
+        elif data.get("audioData"):
+            storage_path = upload_audio_base64(data.get("audioData"), expected_sha256=data.get("audioSha256"))
+    except ValueError:
+        raise InvalidAudio()
+    except PayloadTooLarge:
+        raise
+    except Exception:
+        # upload failed; continue but don't block insertion
+        logger.exception("audio upload error for %s", aid)
+        storage_path = None
+
+    record = build_record(aid, data, cleaned, storage_path)
+    _insert(record, idempotent)
+    return record
+
+
+def _submit_with_spooled_audio(aid, data, cleaned, audio_source, idempotent):
+    """
+    Spool the recording locally, insert the row as audio_pending and hand the
+    upload to the background queue, so the request costs a single DB write.
+    """
+    content_type = "audio/webm"
+    try:
+        if audio_source is not None:
+            stream, content_type = audio_source
+            spooled = upload_queue.spool_stream(aid, stream)
+        else:
+            spooled = upload_queue.spool_base64(aid, data.get("audioData"), data.get("audioSha256"))
+    except ValueError:
+        raise InvalidAudio()
+
+    record = build_record(aid, data, cleaned, status="audio_pending" if spooled else "submitted")
+    try:
+        _insert(record, idempotent)
+    except DuplicateSubmission:
+        # the spool belongs to the first attempt, whose upload is already queued
+        raise
+    except Exception:
+        upload_queue.discard(aid)
+        raise
+    if spooled:
+        upload_queue.submit(aid, content_type)
+    return record
+
+
 @app.route("/api/submit_test", methods=["POST"])
 def submit_test():
     """
-    Accepts JSON payload from frontend. Required fields:
+    Accepts a submission in one of three encodings:
+    - application/json: the original contract, audio in audioData
+      (base64 string, may include data: prefix)
+    - multipart/form-data: fields as form fields (or a JSON "metadata" field),
+      audio as the "audio" file part
+    - application/octet-stream or audio/*: raw audio body, fields as JSON in the
+      X-Assessment-Metadata header
+    Required fields:
     - age, gender, currentMedication, recordingEnvironment, languageDialect
     - question1..question8 (0..3)
     - consent or consentData (object with required consent booleans)
-    - audioData (base64 string, may include data: prefix)
+
+    Retries: with an Idempotency-Key header (or clientId field) the assessment
+    id is derived from the key, and a repeat returns the original result with
+    200 instead of inserting again. audioSha256 (hex SHA-256 of the recording)
+    may replace audioData when GET /api/audio/<sha256> says it is stored, and
+    audioUploadId may name a finalized upload session (/api/uploads).
     """
     try:
-        data = request.get_json()
-        if not data:
+        try:
+            with span("parse"):
+                data, audio_source = _read_submission()
+        except ValueError:
             return jsonify({"error":"invalid_json"}), 400
+        if not isinstance(data, dict):
+            return jsonify({"error":"invalid_json"}), 400
+
+        with span("validate"):
+            error, cleaned = validate_submission(data, require_audio_data=audio_source is None)
+        if error:
+            return jsonify({"error": error}), 400
+
+        # create assessment id; a retried request maps to the same id
+        idempotency_key = request.headers.get("Idempotency-Key") or data.get("clientId")
+        if idempotency_key:
+            aid = assessment_id_for(idempotency_key)
+            existing = _existing_submission(aid)
+            if existing:
+                return jsonify(existing), 200
+        else:
+            aid = str(uuid.uuid4())
+
+        idempotent = bool(idempotency_key)
+        if data.get("audioUploadId") and audio_source is None and not data.get("audioData"):
+            record = _submit_with_upload_session(aid, data, cleaned, idempotent)
+        elif data.get("audioSha256") and audio_source is None and not data.get("audioData"):
+            record = _submit_with_stored_audio(aid, data, cleaned, idempotent)
+        elif UPLOAD_MODE == "async":
+            record = _submit_with_spooled_audio(aid, data, cleaned, audio_source, idempotent)
+        else:
+            record = _submit_with_inline_audio(aid, data, cleaned, audio_source, idempotent)
+        stats_aggregate.record(record)
+        stats_hub.notify()
+        invalidate_assessment(aid)
+
+        return jsonify(submission_result(record)), 201
+
+    except DuplicateSubmission as e:
+        return jsonify(e.result), 200
+    except InvalidAudio:
+        return jsonify({"error":"invalid_audio_data"}), 400
+    except AudioNotFound:
+        return jsonify({"error":"audio_not_found"}), 400
+    except UploadNotFound:
+        return jsonify({"error":"upload_not_found"}), 400
+    except UploadIncomplete:
+        return jsonify({"error":"upload_not_finalized"}), 400
+    except PayloadTooLarge as e:
+        return too_large_response(e)
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("%s failed", request.endpoint)
+        metrics.record_error()
+        return jsonify({"error":"server_error","details": str(e)}), 500
 
-        # Accept consent key in either name
-        consent = data.get("consent") or data.get("consentData") or {}
 
-        # Validate required fields
-        required = ["age","gender","currentMedication","recordingEnvironment","languageDialect",
-                    "question1","question2","question3","question4","question5","question6","question7","question8","audioData"]
-        for field in required:
-            if field not in data:
-                return jsonify({"error": f"missing_{field}"}), 400
+@app.route("/api/audio/<sha256>")
+def audio_status(sha256):
+    """Whether a recording with this SHA-256 is stored, so a retry can skip re-sending it."""
+    if not SHA256_HEX.match(sha256):
+        return jsonify({"error": "invalid_sha256"}), 400
+    try:
+        return jsonify({"sha256": sha256, "exists": audio_exists(content_storage_path(sha256))}), 200
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("error looking up audio %s", sha256)
+        return jsonify({"error":"server_error","details": str(e)}), 500
 
-        # age validation
-        try:
-            age = int(data.get("age"))
-        except:
-            return jsonify({"error":"age_must_be_integer"}), 400
-        if age < 18:
-            return jsonify({"error":"age_must_be_18_or_over"}), 400
-
-        # optional: enforce consent fields are true
-        consent_required_fields = [
-            "voluntary","optOut","ageConfirm","aiRole","purpose",
-            "nonDiagnostic","dataType","anonymization","futureResearch","thirdParty"
-        ]
-        for cf in consent_required_fields:
-            if not consent.get(cf, False):
-                return jsonify({"error": f"consent_required_{cf}"}), 400
-
-        # compute PHQ8 score & severity
-        phq_answers = {f"question{i}": data.get(f"question{i}") for i in range(1,9)}
-        score, severity = calculate_phq8_score_and_severity(phq_answers)
-
-        # create assessment id
-        aid = str(uuid.uuid4())
-
-        # upload audio to storage (returns storage_path and signed url)
-        audio_base64 = data.get("audioData")
-        storage_path, signed_url = None, None
-        if audio_base64:
-            try:
-                storage_path, signed_url = upload_audio_base64(aid, audio_base64)
-            except Exception as e:
-                # upload failed; continue but don't block insertion
-                print("audio upload error:", e)
-                storage_path, signed_url = None, None
-
-        record = {
-            "id": aid,
-            "full_name": data.get("fullName") or None,
-            "age": age,
-            "gender": data.get("gender"),
-            "current_medication": data.get("currentMedication"),
-            "recording_environment": data.get("recordingEnvironment"),
-            "language_dialect": data.get("languageDialect"),
-            "question1": int(data.get("question1")),
-            "question2": int(data.get("question2")),
-            "question3": int(data.get("question3")),
-            "question4": int(data.get("question4")),
-            "question5": int(data.get("question5")),
-            "question6": int(data.get("question6")),
-            "question7": int(data.get("question7")),
-            "question8": int(data.get("question8")),
-            "phq8_total_score": score,
-            "severity": severity,
-            "consent_data": consent,
-            "audio_path": storage_path,
-            "audio_url": signed_url,
-            "has_audio": bool(signed_url),
-            "status": "submitted",
-            "created_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat()
-        }
 
-        # insert to supabase
-        insert_res = supabase.table(ASSESSMENTS_TABLE).insert(record).execute()
-        # check result
-        data_inserted = _safe_get_response_data(insert_res)
+def _upload_headers(session: dict) -> dict:
+    headers = {"Upload-Offset": str(session["offset"]), "Cache-Control": "no-store"}
+    if session["length"] is not None:
+        headers["Upload-Length"] = str(session["length"])
+    return headers
 
-        return jsonify({
-            "testId": aid,
-            "status": "submitted",
-            "phq8Score": score,
-            "severity": severity
-        }), 201
 
+def _upload_state(session: dict):
+    return jsonify({"uploadId": session["id"], "offset": session["offset"], "length": session["length"],
+                    "sha256": session["sha256"]}), _upload_headers(session)
+
+
+@app.route("/api/uploads", methods=["POST"])
+def create_upload():
+    """
+    Open a resumable upload session (services/upload_sessions.py).
+    Body (optional JSON): {"contentType": "audio/webm", "length": total bytes}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        length = int(data["length"]) if data.get("length") is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid_length"}), 400
+    try:
+        session = upload_sessions.create(data.get("contentType") or "audio/webm", length)
+    except PayloadTooLarge as e:
+        return too_large_response(e)
+    body, headers = _upload_state(session)
+    headers["Location"] = f"/api/uploads/{session['id']}"
+    return body, 201, headers
+
+
+@app.route("/api/uploads/<upload_id>", methods=["HEAD", "PATCH"])
+def append_upload(upload_id):
+    """
+    HEAD: the session's current Upload-Offset.
+    PATCH: raw bytes appended at the Upload-Offset header; 409 with the
+    current offset if it does not match (resume from there).
+    """
+    try:
+        if request.method == "HEAD":
+            return "", 200, _upload_headers(upload_sessions.get(upload_id))
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            return jsonify({"error": "missing_upload_offset"}), 400
+        return _upload_state(upload_sessions.append(upload_id, offset, request.stream))
+    except UploadNotFound:
+        return jsonify({"error": "upload_not_found"}), 404
+    except OffsetMismatch as e:
+        return jsonify({"error": "offset_mismatch", "offset": e.offset}), 409, {"Upload-Offset": str(e.offset)}
+    except UploadIncomplete:
+        return jsonify({"error": "upload_finalized"}), 409
+    except PayloadTooLarge as e:
+        return too_large_response(e)
+
+
+@app.route("/api/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id):
+    """Seal the session; optional {"sha256"} is checked against the received bytes."""
+    data = request.get_json(silent=True) or {}
+    try:
+        return _upload_state(upload_sessions.finalize(upload_id, data.get("sha256")))
+    except UploadNotFound:
+        return jsonify({"error": "upload_not_found"}), 404
+    except UploadIncomplete:
+        return jsonify({"error": "upload_incomplete"}), 409
+    except ValueError:
+        return jsonify({"error": "sha256_mismatch"}), 400
+
+
+@app.route("/api/submit_batch", methods=["POST"])
+def submit_batch():
+    """
+    Sync many offline submissions at once. Body: {"items": [...]} where each
+    item is a submit_test JSON payload plus a client-generated "clientId".
+    Returns per-item results; retrying the same clientIds is safe.
+    """
+    try:
+        data = request.get_json(silent=True)
+        items = data.get("items") if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({"error":"invalid_json"}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({"error": "batch_too_large", "maxItems": BATCH_MAX_ITEMS}), 400
+        return jsonify(process_batch(items)), 200
+    except PayloadTooLarge as e:
+        return too_large_response(e)
+    except CircuitOpen as e:
+        return _unavailable(e)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("%s failed", request.endpoint)
+        metrics.record_error()
         return jsonify({"error":"server_error","details": str(e)}), 500
 
 
 @app.route("/api/assessment/<aid>")
 def get_assessment(aid):
-    try:
-        res = supabase.table(ASSESSMENTS_TABLE).select("*").eq("id", aid).execute()
+    def produce():
+        with span("db_query"):
+            res = get_supabase().table(ASSESSMENTS_TABLE).select("*").eq("id", aid).execute()
         rows = _safe_get_response_data(res) or []
         if not rows:
-            return jsonify({"error": "not_found"}), 404
-        return jsonify(rows[0]), 200
+            return {"error": "not_found"}, 404
+        return attach_audio_urls(rows)[0], 200
+
+    try:
+        return cached_json(f"assessment:{aid}", produce)
+    except CircuitOpen as e:
+        return _unavailable(e)
     except Exception as e:
+        logger.exception("error fetching assessment %s", aid)
         return jsonify({"error":"server_error","details": str(e)}), 500
 
 
 @app.route("/api/assessments")
 def all_assessments():
+    """
+    Keyset-paginated listing, newest first.
+    Query params:
+    - limit: page size, capped at ASSESSMENTS_MAX_PAGE_SIZE
+    - cursor: next_cursor from the previous page
+    - fields: comma separated columns to return (default: all)
+    - offset: legacy offset paging, used only when no cursor is given
+    """
+    def produce():
+        try:
+            limit = min(max(int(request.args.get("limit", 50)), 1), MAX_PAGE_SIZE)
+            columns = parse_fields(request.args.get("fields"))
+            offset = parse_offset(request.args.get("offset", 0))
+        except ValueError as e:
+            return {"error": "invalid_params", "details": str(e)}, 400
+
+        cursor = request.args.get("cursor")
+        if "offset" in request.args and not cursor:
+            with span("db_query"):
+                res = get_supabase().table(ASSESSMENTS_TABLE).select(columns).order("created_at", desc=True).range(offset, offset + limit - 1).execute()
+            rows = _safe_get_response_data(res) or []
+            next_cursor = encode_cursor(rows[-1]) if len(rows) == limit else None
+        else:
+            try:
+                with span("db_query"):
+                    rows, next_cursor = fetch_assessment_page(columns, limit, cursor)
+            except ValueError:
+                return {"error": "invalid_cursor"}, 400
+        attach_audio_urls(rows)
+        return {"assessments": rows, "count": len(rows), "next_cursor": next_cursor}, 200
+
     try:
-        limit = int(request.args.get("limit", 50))
-        offset = int(request.args.get("offset", 0))
-        res = supabase.table(ASSESSMENTS_TABLE).select("*").order("created_at", desc=True).range(offset, offset + limit - 1).execute()
-        rows = _safe_get_response_data(res) or []
-        return jsonify({"assessments": rows, "count": len(rows)}), 200
+        key = "assessments:" + urlencode(sorted(request.args.items(multi=True)))
+        return cached_json(key, produce)
+    except CircuitOpen as e:
+        return _unavailable(e)
     except Exception as e:
+        logger.exception("error listing assessments")
         return jsonify({"error":"server_error","details": str(e)}), 500
 
 
+@app.route("/api/export")
+def export_dataset():
+    """
+    Stream the whole dataset. Requires the X-Admin-Token header.
+    Query params:
+    - format: ndjson (default), csv, parquet, or zip/tar for the recordings
+    - fields: comma separated columns (tabular formats)
+    - cursor: resume after the row it encodes; the cursor of any exported row
+      is base64url(JSON [created_at, id]), the same format /api/assessments uses
+    """
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "forbidden"}), 403
+
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_CONTENT_TYPES:
+        return jsonify({"error": "invalid_format"}), 400
+    columns = None
+    if request.args.get("fields"):
+        columns = [c.strip() for c in request.args["fields"].split(",") if c.strip()]
+        if any(c not in ASSESSMENT_COLUMNS for c in columns):
+            return jsonify({"error": "invalid_fields"}), 400
+    cursor = request.args.get("cursor")
+    try:
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError:
+        return jsonify({"error": "invalid_cursor"}), 400
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return jsonify({"error": "parquet_unavailable"}), 400
+    # a stream cannot change its status once started, so refuse up front
+    wait = supabase_breaker.retry_after()
+    if wait:
+        return _unavailable(CircuitOpen(wait))
+
+    def generate():
+        for data, _ in export_chunks(fmt, columns, cursor):
+            if data:
+                yield data
+
+    filename = f"voice_assessments.{fmt}"
+    return Response(stream_with_context(generate()), mimetype=EXPORT_CONTENT_TYPES[fmt],
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+@app.route("/api/cache/stats")
+def cache_stats():
+    """Hit/miss counters for tuning CACHE_TTL_SECONDS (per process for the memory backend)."""
+    return jsonify(cache.stats()), 200
+
+
+@app.route("/api/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint; aggregates every gunicorn worker when PROMETHEUS_MULTIPROC_DIR is set."""
+    body, content_type = metrics_response()
+    return Response(body, content_type=content_type)
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV', 'production') != 'production'
@@ -0,0 +1,407 @@
+# asgi.py
+"""
+Async serving mode.
+
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+    uvicorn asgi:app --port 5000
+
+The hot JSON routes (POST /api/submit_test with a JSON body, /api/stats,
+/api/assessments, /api/assessment/<id>) run on the event loop with the async
+Supabase client, so a worker keeps many requests in flight while they wait on
+the network; /api/stats/stream holds its SSE subscribers there too, without a
+thread each. Everything else, including multipart and raw-audio submissions,
+is passed to the Flask app unchanged. Routes keep the contracts of app.py:
+same bodies, status codes, ETags and cache keys.
+
+With AUDIO_UPLOAD_MODE=sync, a submission uploads its recording and inserts
+its row concurrently, and signs the new recording's URL while the insert is
+still in flight. Recordings are stored under their content hash, so the row's
+audio_path is known before the upload starts.
+"""
+import os
+import re
+import json
+import uuid
+import asyncio
+import logging
+from urllib.parse import urlencode
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import parse_etags
+
+from app import (
+    app as flask_app, InvalidAudio, AudioNotFound, DuplicateSubmission, submission_result, _submit_with_upload_session,
+    ASSESSMENTS_TABLE, MAX_PAGE_SIZE,
+    CORS_ORIGINS, CORS_METHODS, CORS_ALLOW_HEADERS, CORS_EXPOSE_HEADERS,
+)
+from services.supabase_client import get_async_supabase
+from services.circuit import CircuitOpen
+from services.storage import (
+    decode_audio_base64, audio_digest, content_storage_path, aaudio_exists, aupload_audio_bytes,
+    asign_audio_paths, aattach_audio_urls,
+)
+from services.submissions import validate_submission, build_record, assessment_id_for
+from services.aggregates import stats_aggregate
+from services.stats_stream import stats_hub, HEADERS as STREAM_HEADERS
+from services.upload_queue import upload_queue, UPLOAD_MODE
+from services.upload_sessions import UploadNotFound, UploadIncomplete
+from services.queries import parse_fields, parse_offset, encode_cursor, afetch_assessment_page
+from services.cache import lookup_entry, store_entry, invalidate_assessment, CACHE_TTL
+from services.admission import admitted, too_large, PayloadTooLarge, Overloaded, BODY_LIMITS
+from services import metrics
+from services.metrics import span, timed
+
+logger = logging.getLogger(__name__)
+
+# threads serving the Flask routes inside each ASGI worker
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", 10))
+
+
+def _json(payload, status: int = 200, headers: dict = None) -> Response:
+    return Response(flask_app.json.dumps(payload), status_code=status, headers=headers,
+                    media_type="application/json")
+
+
+def _unavailable(e: CircuitOpen) -> Response:
+    return _json({"error": "service_unavailable", "retryAfter": e.retry_after}, 503,
+                 headers={"Retry-After": str(e.retry_after)})
+
+
+async def _cached_json(request, key: str, producer, ttl: float = CACHE_TTL) -> Response:
+    """services.cache.cached_json for async producers; shares the same cache entries."""
+    entry = lookup_entry(key)
+    if entry is None:
+        payload, status = await producer()
+        body = flask_app.json.dumps(payload)
+        if status != 200:
+            return Response(body, status_code=status, media_type="application/json")
+        entry = store_entry(key, body, ttl)
+
+    headers = {"ETag": f'"{entry["etag"]}"', "Cache-Control": "no-cache"}
+    if parse_etags(request.headers.get("if-none-match")).contains(entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], headers=headers, media_type="application/json")
+
+
+async def _existing_submission(aid):
+    client = await get_async_supabase()
+    with span("db_query"):
+        res = await client.table(ASSESSMENTS_TABLE).select("id,status,phq8_total_score,severity").eq("id", aid).execute()
+    rows = res.data or []
+    return submission_result(rows[0]) if rows else None
+
+
+async def _insert(record: dict, idempotent: bool = False):
+    client = await get_async_supabase()
+    try:
+        with span("db_insert"):
+            await client.table(ASSESSMENTS_TABLE).insert(record).execute()
+    except Exception:
+        existing = await _existing_submission(record["id"]) if idempotent else None
+        if existing:
+            raise DuplicateSubmission(existing)
+        raise
+
+
+async def _submit_with_stored_audio(aid, data, cleaned, idempotent):
+    storage_path = content_storage_path(data["audioSha256"])
+    if not await aaudio_exists(storage_path):
+        raise AudioNotFound()
+    record = build_record(aid, data, cleaned, storage_path)
+    await _insert(record, idempotent)
+    return record
+
+
+async def _submit_with_spooled_audio(aid, data, cleaned, idempotent):
+    """AUDIO_UPLOAD_MODE=async: spool the recording, one DB write, upload in the background."""
+    try:
+        spooled = await run_in_threadpool(upload_queue.spool_base64, aid, data.get("audioData"),
+                                          data.get("audioSha256"))
+    except ValueError:
+        raise InvalidAudio()
+
+    record = build_record(aid, data, cleaned, status="audio_pending" if spooled else "submitted")
+    try:
+        await _insert(record, idempotent)
+    except DuplicateSubmission:
+        raise
+    except Exception:
+        upload_queue.discard(aid)
+        raise
+    if spooled:
+        upload_queue.submit(aid)
+    return record
+
+
+async def _submit_with_concurrent_upload(aid, data, cleaned, idempotent):
+    """
+    AUDIO_UPLOAD_MODE=sync: upload the recording and insert the row at the same
+    time. The storage path is known up front, so the row can reference it
+    before the upload finishes; if the upload fails the bytes are spooled and
+    the row is switched to audio_pending for the background queue.
+    """
+    audio_bytes = None
+    if data.get("audioData"):
+        try:
+            audio_bytes = decode_audio_base64(data["audioData"])
+            digest = audio_digest(audio_bytes, data.get("audioSha256")) if audio_bytes else None
+        except ValueError:
+            raise InvalidAudio()
+    if not audio_bytes:
+        record = build_record(aid, data, cleaned)
+        await _insert(record, idempotent)
+        return record
+
+    record = build_record(aid, data, cleaned, content_storage_path(digest))
+
+    async def upload_and_sign():
+        path = await aupload_audio_bytes(audio_bytes, sha256=digest)
+        try:
+            # warm the URL cache so the first read of this assessment needs no signing call
+            await asign_audio_paths([path])
+        except Exception as e:
+            logger.warning("could not pre-sign %s: %s", path, e)
+
+    uploaded, inserted = await asyncio.gather(upload_and_sign(), _insert(record, idempotent), return_exceptions=True)
+    if isinstance(inserted, BaseException):
+        raise inserted
+    if isinstance(uploaded, BaseException):
+        logger.warning("audio upload error for %s, spooling: %s", aid, uploaded)
+        await run_in_threadpool(upload_queue.spool_bytes, aid, audio_bytes)
+        record.update({"audio_path": None, "has_audio": False, "status": "audio_pending"})
+        client = await get_async_supabase()
+        with span("db_update"):
+            await client.table(ASSESSMENTS_TABLE).update(
+                {"audio_path": None, "has_audio": False, "status": "audio_pending"}
+            ).eq("id", aid).execute()
+        upload_queue.submit(aid)
+    return record
+
+
+async def _read_body(request, endpoint: str) -> bytes:
+    """The request body, failing as soon as it passes the endpoint's ceiling."""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > BODY_LIMITS[endpoint]:
+            raise too_large(endpoint)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@timed("submit_test")
+async def submit_test(request):
+    """JSON contract of app.submit_test, under the same admission control; other encodings are served by Flask."""
+    length = request.headers.get("content-length")
+    try:
+        with admitted("submit_test", int(length) if length and length.isdigit() else None, is_json=True):
+            return await _submit_test(request)
+    except PayloadTooLarge as e:
+        return _json({"error": "payload_too_large", "maxBytes": e.max_bytes}, 413)
+    except Overloaded as e:
+        return _json({"error": "server_busy", "retryAfter": e.retry_after}, 503,
+                     headers={"Retry-After": str(e.retry_after)})
+
+
+async def _submit_test(request):
+    try:
+        body = await _read_body(request, "submit_test")
+        try:
+            with span("parse"):
+                data = json.loads(body)
+        except ValueError:
+            return _json({"error":"invalid_json"}, 400)
+        if not isinstance(data, dict):
+            return _json({"error":"invalid_json"}, 400)
+
+        with span("validate"):
+            error, cleaned = validate_submission(data)
+        if error:
+            return _json({"error": error}, 400)
+
+        idempotency_key = request.headers.get("idempotency-key") or data.get("clientId")
+        if idempotency_key:
+            aid = assessment_id_for(idempotency_key)
+            existing = await _existing_submission(aid)
+            if existing:
+                return _json(existing, 200)
+        else:
+            aid = str(uuid.uuid4())
+
+        idempotent = bool(idempotency_key)
+        if data.get("audioUploadId") and not data.get("audioData"):
+            # the recording is a local file: disk and sync client work, off the event loop
+            record = await run_in_threadpool(_submit_with_upload_session, aid, data, cleaned, idempotent)
+        elif data.get("audioSha256") and not data.get("audioData"):
+            record = await _submit_with_stored_audio(aid, data, cleaned, idempotent)
+        elif UPLOAD_MODE == "async":
+            record = await _submit_with_spooled_audio(aid, data, cleaned, idempotent)
+        else:
+            record = await _submit_with_concurrent_upload(aid, data, cleaned, idempotent)
+        stats_aggregate.record(record)
+        stats_hub.notify()
+        invalidate_assessment(aid)
+
+        return _json(submission_result(record), 201)
+
+    except DuplicateSubmission as e:
+        return _json(e.result, 200)
+    except InvalidAudio:
+        return _json({"error":"invalid_audio_data"}, 400)
+    except AudioNotFound:
+        return _json({"error":"audio_not_found"}, 400)
+    except UploadNotFound:
+        return _json({"error":"upload_not_found"}, 400)
+    except UploadIncomplete:
+        return _json({"error":"upload_not_finalized"}, 400)
+    except PayloadTooLarge:
+        raise
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("submit_test failed")
+        metrics.record_error()
+        return _json({"error":"server_error","details": str(e)}, 500)
+
+
+async def stream_stats(request):
+    """app.py's stream_stats; an idle subscriber is a suspended generator, not a thread."""
+    try:
+        await run_in_threadpool(stats_hub.open)
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("error opening stats stream")
+        metrics.record_error()
+        return _json({"error": str(e)}, 500)
+    return StreamingResponse(stats_hub.events(), media_type="text/event-stream", headers=STREAM_HEADERS)
+
+
+@timed("get_stats")
+async def get_stats(request):
+    async def produce():
+        # usually a no-op; the periodic catch-up scan runs off the event loop
+        with span("stats_refresh"):
+            await run_in_threadpool(stats_aggregate.refresh)
+        return stats_aggregate.to_response(), 200
+
+    try:
+        return await _cached_json(request, "stats", produce)
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("error fetching stats")
+        metrics.record_error()
+        return _json({"error": str(e)}, 500)
+
+
+@timed("get_assessment")
+async def get_assessment(request):
+    aid = request.path_params["aid"]
+
+    async def produce():
+        client = await get_async_supabase()
+        with span("db_query"):
+            res = await client.table(ASSESSMENTS_TABLE).select("*").eq("id", aid).execute()
+        rows = res.data or []
+        if not rows:
+            return {"error": "not_found"}, 404
+        return (await aattach_audio_urls(rows))[0], 200
+
+    try:
+        return await _cached_json(request, f"assessment:{aid}", produce)
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("error fetching assessment %s", aid)
+        return _json({"error":"server_error","details": str(e)}, 500)
+
+
+@timed("all_assessments")
+async def all_assessments(request):
+    args = request.query_params
+
+    async def produce():
+        try:
+            limit = min(max(int(args.get("limit", 50)), 1), MAX_PAGE_SIZE)
+            columns = parse_fields(args.get("fields"))
+            offset = parse_offset(args.get("offset", 0))
+        except ValueError as e:
+            return {"error": "invalid_params", "details": str(e)}, 400
+
+        cursor = args.get("cursor")
+        if "offset" in args and not cursor:
+            client = await get_async_supabase()
+            with span("db_query"):
+                res = await client.table(ASSESSMENTS_TABLE).select(columns).order("created_at", desc=True).range(offset, offset + limit - 1).execute()
+            rows = res.data or []
+            next_cursor = encode_cursor(rows[-1]) if len(rows) == limit else None
+        else:
+            try:
+                with span("db_query"):
+                    rows, next_cursor = await afetch_assessment_page(columns, limit, cursor)
+            except ValueError:
+                return {"error": "invalid_cursor"}, 400
+        await aattach_audio_urls(rows)
+        return {"assessments": rows, "count": len(rows), "next_cursor": next_cursor}, 200
+
+    try:
+        key = "assessments:" + urlencode(sorted(args.multi_items()))
+        return await _cached_json(request, key, produce)
+    except CircuitOpen as e:
+        return _unavailable(e)
+    except Exception as e:
+        logger.exception("error listing assessments")
+        return _json({"error":"server_error","details": str(e)}, 500)
+
+
+def _origin_regex(origins):
+    # "https://*.vercel.app" style entries; Starlette matches these as a regex
+    patterns = [re.escape(o).replace(r"\*", "[^/]+") for o in origins if "*" in o]
+    return "|".join(patterns) or None
+
+
+api = Starlette(
+    routes=[
+        Route("/api/submit_test", submit_test, methods=["POST"]),
+        Route("/api/stats", get_stats),
+        Route("/api/stats/stream", stream_stats),
+        Route("/api/assessments", all_assessments),
+        Route("/api/assessment/{aid}", get_assessment),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=[o for o in CORS_ORIGINS if "*" not in o],
+            allow_origin_regex=_origin_regex(CORS_ORIGINS),
+            allow_methods=CORS_METHODS,
+            allow_headers=CORS_ALLOW_HEADERS,
+            expose_headers=CORS_EXPOSE_HEADERS,
+            allow_credentials=True,
+        )
+    ],
+)
+wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+
+
+def _is_async_route(scope) -> bool:
+    path = scope["path"]
+    if path == "/api/submit_test":
+        if scope["method"] != "POST":
+            return False
+        content_type = dict(scope["headers"]).get(b"content-type", b"")
+        return content_type.split(b";", 1)[0].strip().lower() == b"application/json"
+    return path in ("/api/stats", "/api/stats/stream", "/api/assessments") or path.startswith("/api/assessment/")
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "http" and not _is_async_route(scope):
+        await wsgi(scope, receive, send)
+    else:
+        await api(scope, receive, send)
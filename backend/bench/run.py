@@ -0,0 +1,338 @@
+# bench/run.py
+"""
+Offline benchmark / load test for the API.
+
+Runs the Flask app in-process against the local backend (SQLite tables plus a
+filesystem bucket, see services/local_backend.py), seeds synthetic assessments
+and recordings, then drives each endpoint from a thread pool and reports
+p50/p99 latency, throughput and, per endpoint, the peak RSS sampled while its
+scenario ran and how far that rose above the RSS at its start.
+
+    cd backend
+    python -m bench.run --rows 10000 --requests 500 --concurrency 16
+    python -m bench.run --rows 1000000 --db-latency-ms 20 --storage-latency-ms 50 --json bench.json
+    python -m bench.run --server asgi --db-latency-ms 20 --storage-latency-ms 50
+
+--server asgi drives asgi.py from a single event loop instead of the Flask app
+from a thread pool, to compare throughput per worker. Seeding is deterministic
+(--seed), so runs are comparable across commits.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import base64
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+SEVERITIES = ["minimal", "mild", "moderate", "moderately-severe", "severe"]
+GENDERS = ["male", "female", "other"]
+CONSENT = {k: True for k in ["voluntary", "optOut", "ageConfirm", "aiRole", "purpose",
+                             "nonDiagnostic", "dataType", "anonymization", "futureResearch", "thirdParty"]}
+
+
+def _configure_env(args):
+    # must run before the app (and services.supabase_client) is imported
+    workdir = tempfile.mkdtemp(prefix="echomind_bench_")
+    os.environ["DATA_BACKEND"] = "local"
+    os.environ["LOCAL_DB_PATH"] = os.path.join(workdir, "bench.sqlite3")
+    os.environ["LOCAL_STORAGE_DIR"] = os.path.join(workdir, "storage")
+    os.environ["AUDIO_SPOOL_DIR"] = os.path.join(workdir, "spool")
+    os.environ["LOCAL_DB_LATENCY_MS"] = str(args.db_latency_ms)
+    os.environ["LOCAL_STORAGE_LATENCY_MS"] = str(args.storage_latency_ms)
+    os.environ["AUDIO_UPLOAD_MODE"] = args.upload_mode
+    if args.no_cache:
+        os.environ["CACHE_TTL_SECONDS"] = "0"
+    return workdir
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    """Resident set size right now (Linux /proc); None where that is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+class RssSampler:
+    """
+    Peak RSS while one scenario runs. ru_maxrss is a high-water mark for the
+    whole process, so every scenario after the heaviest one would inherit its
+    peak; this samples the current RSS from a thread instead. Where current
+    RSS cannot be read, it falls back to ru_maxrss and reports no delta.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start = self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start = current_rss_mb()
+        self.peak = self.start
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._sample()
+        return False
+
+    def result(self) -> dict:
+        if self.start is None:
+            return {"peak_rss_mb": round(peak_rss_mb(), 1), "rss_delta_mb": None}
+        return {"peak_rss_mb": round(self.peak, 1), "rss_delta_mb": round(self.peak - self.start, 1)}
+
+
+def synthetic_row(rng: random.Random, i: int, start: datetime) -> dict:
+    answers = {f"question{q}": rng.randint(0, 3) for q in range(1, 9)}
+    score = sum(answers.values())
+    severity = SEVERITIES[min(score // 5, 4)]
+    created = (start + timedelta(seconds=i)).isoformat()
+    aid = f"{rng.getrandbits(128):032x}"
+    aid = f"{aid[:8]}-{aid[8:12]}-{aid[12:16]}-{aid[16:20]}-{aid[20:]}"
+    row = {
+        "id": aid,
+        "full_name": None,
+        "age": rng.randint(18, 70),
+        "gender": rng.choice(GENDERS),
+        "current_medication": rng.choice(["yes", "no"]),
+        "recording_environment": rng.choice(["quiet", "noisy", "outdoor"]),
+        "language_dialect": rng.choice(["standard", "dhaka", "chittagong", "sylheti"]),
+        "phq8_total_score": score,
+        "severity": severity,
+        "consent_data": CONSENT,
+        "audio_path": f"recordings/{aid}.webm",
+        "audio_url": None,
+        "has_audio": True,
+        "status": "submitted",
+        "created_at": created,
+        "updated_at": created,
+    }
+    row.update(answers)
+    return row
+
+
+def seed(client, table: str, bucket: str, rows: int, audio_blobs: int, audio_bytes: int, rng: random.Random):
+    start = datetime(2024, 1, 1)
+    batch, ids = [], []
+    for i in range(rows):
+        row = synthetic_row(rng, i, start)
+        batch.append(row)
+        ids.append(row["id"])
+        if len(batch) == 5000:
+            client.table(table).insert(batch).execute()
+            batch = []
+    if batch:
+        client.table(table).insert(batch).execute()
+
+    store = client.storage.from_(bucket)
+    blob = rng.randbytes(audio_bytes)
+    for aid in ids[:audio_blobs]:
+        store.upload(f"recordings/{aid}.webm", blob)
+    return ids
+
+
+def submission_payload(rng: random.Random, audio_b64: str) -> dict:
+    payload = {
+        "age": rng.randint(18, 70),
+        "gender": rng.choice(GENDERS),
+        "currentMedication": "no",
+        "recordingEnvironment": "quiet",
+        "languageDialect": "standard",
+        "consentData": CONSENT,
+        "audioData": f"data:audio/webm;base64,{audio_b64}",
+    }
+    payload.update({f"question{q}": rng.randint(0, 3) for q in range(1, 9)})
+    return payload
+
+
+def run_scenario(name, request_fn, requests: int, concurrency: int) -> dict:
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def one(i):
+        t0 = time.perf_counter()
+        try:
+            status = request_fn(i)
+        except Exception as e:
+            status = repr(e)
+        elapsed = time.perf_counter() - t0
+        with lock:
+            latencies.append(elapsed)
+            if not (isinstance(status, int) and status < 400):
+                errors.append(status)
+
+    with RssSampler() as rss:
+        wall0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - wall0
+    return summarize(name, requests, latencies, errors, wall, rss)
+
+
+async def run_scenario_async(name, request_fn, requests: int, concurrency: int) -> dict:
+    """run_scenario for a coroutine request_fn, with up to `concurrency` requests in flight."""
+    latencies, errors = [], []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with slots:
+            t0 = time.perf_counter()
+            try:
+                status = await request_fn(i)
+            except Exception as e:
+                status = repr(e)
+            latencies.append(time.perf_counter() - t0)
+            if not (isinstance(status, int) and status < 400):
+                errors.append(status)
+
+    with RssSampler() as rss:
+        wall0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - wall0
+    return summarize(name, requests, latencies, errors, wall, rss)
+
+
+def summarize(name, requests: int, latencies: list, errors: list, wall: float, rss: RssSampler) -> dict:
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))] * 1000
+
+    return {
+        "endpoint": name,
+        "requests": requests,
+        "errors": len(errors),
+        "p50_ms": round(pct(50), 2),
+        "p99_ms": round(pct(99), 2),
+        "throughput_rps": round(requests / wall, 1) if wall else 0,
+        **rss.result(),
+    }
+
+
+async def _run_asgi(scenarios, names, args) -> list:
+    import httpx
+    from asgi import app as asgi_app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url="http://bench") as client:
+        def call(spec):
+            async def request_fn(i):
+                method, path, params, body = spec(i)
+                return (await client.request(method, path, params=params, json=body)).status_code
+            return request_fn
+        return [await run_scenario_async(name, call(scenarios[name]), args.requests, args.concurrency)
+                for name in names]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline API benchmark")
+    parser.add_argument("--rows", type=int, default=10000, help="synthetic assessments to seed")
+    parser.add_argument("--audio-blobs", type=int, default=1000, help="recordings to seed in the bucket")
+    parser.add_argument("--audio-bytes", type=int, default=64 * 1024, help="size of each synthetic recording")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    parser.add_argument("--storage-latency-ms", type=float, default=0)
+    parser.add_argument("--upload-mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi",
+                        help="Flask app from a thread pool, or asgi.py from one event loop")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--endpoints", default="submit_test,stats,assessments,assessments_deep,assessment")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    workdir = _configure_env(args)
+    from app import app, ASSESSMENTS_TABLE
+    from services.supabase_client import get_supabase
+    from services.storage import BUCKET
+
+    rng = random.Random(args.seed)
+    t0 = time.perf_counter()
+    ids = seed(get_supabase(), ASSESSMENTS_TABLE, BUCKET, args.rows, min(args.audio_blobs, args.rows),
+               args.audio_bytes, rng)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - t0:.1f}s")
+
+    client = app.test_client()
+    audio_b64 = base64.b64encode(rng.randbytes(args.audio_bytes)).decode()
+
+    # cursors for deep pages, collected up front so the scenario measures a single page fetch
+    deep_cursors = []
+    cursor = None
+    while len(deep_cursors) < 20:
+        res = client.get("/api/assessments", query_string={"limit": 200, "fields": "id", **({"cursor": cursor} if cursor else {})})
+        cursor = res.get_json().get("next_cursor")
+        if not cursor:
+            break
+        deep_cursors.append(cursor)
+
+    # (method, path, query params, JSON body) of the i-th request per scenario
+    scenarios = {
+        "submit_test": lambda i: ("POST", "/api/submit_test", None, submission_payload(random.Random(i), audio_b64)),
+        "stats": lambda i: ("GET", "/api/stats", None, None),
+        "assessments": lambda i: ("GET", "/api/assessments", {"limit": 50}, None),
+        "assessments_deep": lambda i: ("GET", "/api/assessments", {
+            "limit": 50, "cursor": deep_cursors[i % len(deep_cursors)]} if deep_cursors else {"limit": 50}, None),
+        "assessment": lambda i: ("GET", f"/api/assessment/{ids[i % len(ids)]}", None, None),
+    }
+    names = [n.strip() for n in args.endpoints.split(",") if n.strip()]
+    for name in names:
+        if name not in scenarios:
+            parser.error(f"unknown endpoint scenario: {name}")
+
+    if args.server == "asgi":
+        results = asyncio.run(_run_asgi(scenarios, names, args))
+    else:
+        def call(spec):
+            def request_fn(i):
+                method, path, params, body = spec(i)
+                return client.open(path, method=method, query_string=params, json=body).status_code
+            return request_fn
+        results = [run_scenario(name, call(scenarios[name]), args.requests, args.concurrency) for name in names]
+
+    header = f"{'endpoint':<18}{'req':>7}{'err':>6}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'rss MB':>9}{'+MB':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['endpoint']:<18}{r['requests']:>7}{r['errors']:>6}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['throughput_rps']:>10}{r['peak_rss_mb']:>9}{r['rss_delta_mb'] if r['rss_delta_mb'] is not None else '-':>7}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
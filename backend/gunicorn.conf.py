@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+# Loaded automatically by `gunicorn app:app` when started from backend/.
+import os
+import shutil
+import tempfile
+
+# Prometheus metrics are kept per worker in this directory and merged by /api/metrics.
+# It must be set before the workers import prometheus_client.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "echomind_prometheus"))
+
+
+def on_starting(server):
+    # stale files from a previous run would be summed into the new totals
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # connect and load the stats counters before this worker takes traffic
+    from services.health import warmup
+    warmup()
@@ -0,0 +1,166 @@
+# services/admission.py
+"""
+Admission control for submissions that carry audio.
+
+Every submit_test / submit_batch request (and upload session chunk) reserves its share of a per-process
+byte budget (AUDIO_INFLIGHT_BUDGET_BYTES) before the body is read and gives it
+back when the request ends. A JSON body is held several times over (raw body,
+base64 string, decoded bytes), so it reserves JSON_MEMORY_FACTOR times its
+size; streamed bodies reserve their size once. When the budget is used up the
+request is turned away at once with 503 and Retry-After instead of queueing,
+so peak memory stays near the budget however bursty the traffic.
+
+Bodies above the endpoint's ceiling get 413: up front when Content-Length is
+known, otherwise as soon as the read goes past it (chunked uploads).
+"""
+import os
+import threading
+from contextlib import contextmanager
+from flask import g, request, jsonify
+from services.metrics import AUDIO_INFLIGHT_BYTES, ADMISSION_REJECTIONS
+
+SUBMIT_MAX_BYTES = int(os.getenv("SUBMIT_MAX_BYTES", 32 * 1024 * 1024))
+BATCH_MAX_BYTES = int(os.getenv("SUBMIT_BATCH_MAX_BYTES", 128 * 1024 * 1024))
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_SESSION_CHUNK_MAX_BYTES", 8 * 1024 * 1024))
+AUDIO_INFLIGHT_BUDGET = int(os.getenv("AUDIO_INFLIGHT_BUDGET_BYTES", 256 * 1024 * 1024))
+JSON_MEMORY_FACTOR = float(os.getenv("AUDIO_JSON_MEMORY_FACTOR", 3))
+RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 2))
+
+# endpoint -> per-request body ceiling
+BODY_LIMITS = {"submit_test": SUBMIT_MAX_BYTES, "submit_batch": BATCH_MAX_BYTES, "append_upload": UPLOAD_CHUNK_MAX_BYTES}
+
+
+class PayloadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"request body exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int = RETRY_AFTER_SECONDS):
+        super().__init__("audio budget exhausted")
+        self.retry_after = retry_after
+
+
+class ByteBudget:
+    """Non-blocking counting semaphore over bytes."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, n: int) -> bool:
+        # a single request larger than the whole budget may still run on its own
+        n = min(n, self.capacity)
+        with self._lock:
+            if self.in_flight and self.in_flight + n > self.capacity:
+                return False
+            self.in_flight += n
+        AUDIO_INFLIGHT_BYTES.inc(n)
+        return True
+
+    def release(self, n: int):
+        n = min(n, self.capacity)
+        with self._lock:
+            self.in_flight -= n
+        AUDIO_INFLIGHT_BYTES.dec(n)
+
+
+audio_budget = ByteBudget(AUDIO_INFLIGHT_BUDGET)
+
+
+def too_large(endpoint: str) -> PayloadTooLarge:
+    """Count a rejection and build the exception for a body over the endpoint's ceiling."""
+    ADMISSION_REJECTIONS.labels(endpoint, "too_large").inc()
+    return PayloadTooLarge(BODY_LIMITS[endpoint])
+
+
+def reserve(endpoint: str, content_length, is_json: bool) -> int:
+    """
+    Check the ceiling and take budget for one request. Returns the bytes to
+    release() afterwards; raises PayloadTooLarge or Overloaded.
+    """
+    max_bytes = BODY_LIMITS[endpoint]
+    if content_length is not None and content_length > max_bytes:
+        raise too_large(endpoint)
+    size = content_length if content_length is not None else max_bytes
+    n = int(size * JSON_MEMORY_FACTOR) if is_json else size
+    if not audio_budget.try_acquire(n):
+        ADMISSION_REJECTIONS.labels(endpoint, "budget").inc()
+        raise Overloaded()
+    return n
+
+
+@contextmanager
+def admitted(endpoint: str, content_length, is_json: bool):
+    n = reserve(endpoint, content_length, is_json)
+    try:
+        yield
+    finally:
+        audio_budget.release(n)
+
+
+class LimitedInput:
+    """wsgi.input wrapper that raises PayloadTooLarge once the read goes past the endpoint's ceiling."""
+
+    def __init__(self, stream, endpoint: str):
+        self._stream = stream
+        self._remaining = BODY_LIMITS[endpoint]
+        self._endpoint = endpoint
+
+    def _count(self, data: bytes) -> bytes:
+        self._remaining -= len(data)
+        if self._remaining < 0:
+            raise too_large(self._endpoint)
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            # read at most one byte past the ceiling, enough to know it was exceeded
+            return self._count(self._stream.read(self._remaining + 1))
+        return self._count(self._stream.read(min(size, self._remaining + 1)))
+
+    def readline(self, size: int = -1) -> bytes:
+        limit = self._remaining + 1 if size is None or size < 0 else min(size, self._remaining + 1)
+        return self._count(self._stream.readline(limit))
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+
+def too_large_response(e: PayloadTooLarge):
+    return jsonify({"error": "payload_too_large", "maxBytes": e.max_bytes}), 413
+
+
+def overloaded_response(e: Overloaded):
+    resp = jsonify({"error": "server_busy", "retryAfter": e.retry_after})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 503
+
+
+def _before_request():
+    endpoint = request.endpoint
+    if endpoint not in BODY_LIMITS or request.method in ("GET", "HEAD", "OPTIONS"):
+        return None
+    try:
+        g.admitted_bytes = reserve(endpoint, request.content_length, request.mimetype == "application/json")
+    except PayloadTooLarge as e:
+        return too_large_response(e)
+    except Overloaded as e:
+        return overloaded_response(e)
+    # the body has not been touched yet, so every later read goes through the limit
+    request.environ["wsgi.input"] = LimitedInput(request.environ["wsgi.input"], endpoint)
+    return None
+
+
+def _teardown_request(exc):
+    n = g.pop("admitted_bytes", None)
+    if n is not None:
+        audio_budget.release(n)
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    app.register_error_handler(PayloadTooLarge, too_large_response)
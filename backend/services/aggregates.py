@@ -0,0 +1,135 @@
+# services/aggregates.py
+import os
+import threading
+from services.queries import CatchupScan
+
+STATS_COLUMNS = "id,created_at,age,gender,severity,phq8_total_score,audio_path,status"
+CATCHUP_INTERVAL = float(os.getenv("STATS_CATCHUP_SECONDS", 10))
+PAGE_SIZE = int(os.getenv("STATS_PAGE_SIZE", 1000))
+
+SEVERITY_LABELS = [
+    ("minimal", "সর্বনিম্ন (0-4)"),
+    ("mild", "সামান্য (5-9)"),
+    ("moderate", "মাঝারি (10-14)"),
+    ("moderately-severe", "মাঝারি থেকে গুরুতর (15-19)"),
+    ("severe", "গুরুতর (20-24)"),
+]
+AGE_GROUPS = ["18-24", "25-34", "35-44", "45-54", "55+"]
+
+
+def age_group(age):
+    """Bucket an age value the way the dashboard does; None if unparseable."""
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return None
+    if 18 <= age <= 24:
+        return "18-24"
+    if 25 <= age <= 34:
+        return "25-34"
+    if 35 <= age <= 44:
+        return "35-44"
+    if 45 <= age <= 54:
+        return "45-54"
+    return "55+"
+
+
+class StatsAggregate:
+    """
+    Running counters behind /api/stats.
+
+    Rows inserted by this process are applied with record() in O(1). Rows
+    written by other workers are picked up by refresh(), which scans forward
+    from CATCHUP_LAG_SECONDS before the last created_at it saw, so rows whose
+    insert landed late are still found. Ids inside that window are kept so
+    rows are never counted twice. A full scan only happens on cold start or
+    via rebuild().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scan = CatchupScan(STATS_COLUMNS, PAGE_SIZE, CATCHUP_INTERVAL)
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.audio = 0
+        self.phq8_sum = 0
+        self.male = 0
+        self.female = 0
+        self.severity = {key: 0 for key, _ in SEVERITY_LABELS}
+        self.ages = {group: 0 for group in AGE_GROUPS}
+        self._scan.reset()
+
+    def _apply(self, row):
+        # caller holds self._lock and got row from self._scan.fresh()
+        self.total += 1
+        # pending rows already have their recording spooled for upload
+        if row.get("audio_path") or row.get("status") == "audio_pending":
+            self.audio += 1
+        try:
+            self.phq8_sum += int(row.get("phq8_total_score") or 0)
+        except (TypeError, ValueError):
+            pass
+
+        gender = (row.get("gender") or "").lower()
+        if gender == "male":
+            self.male += 1
+        elif gender == "female":
+            self.female += 1
+
+        sev = (row.get("severity") or "").lower()
+        if sev in self.severity:
+            self.severity[sev] += 1
+
+        group = age_group(row.get("age"))
+        if group:
+            self.ages[group] += 1
+
+    def record(self, row: dict):
+        """Apply a row this process just inserted."""
+        with self._lock:
+            for row in self._scan.fresh([row], stored=False):
+                self._apply(row)
+
+    def _apply_page(self, page: list):
+        with self._lock:
+            for row in self._scan.fresh(page):
+                self._apply(row)
+
+    def refresh(self, force: bool = False):
+        """
+        Catch up with rows written elsewhere. Cheap when called often: it is
+        a no-op until STATS_CATCHUP_SECONDS have elapsed since the last scan.
+        """
+        self._scan.run(self._apply_page, force=force)
+
+    def _clear(self):
+        with self._lock:
+            self._reset()
+
+    def rebuild(self):
+        """Drop all counters and rescan the whole table."""
+        self._scan.rebuild(self._clear, self._apply_page)
+
+    def to_response(self) -> dict:
+        with self._lock:
+            total = self.total
+
+            def pct(n):
+                return round((n / total) * 100, 1) if total > 0 else 0
+
+            return {
+                "totalTests": total,
+                "totalAudio": self.audio,
+                "averagePhq8": round(self.phq8_sum / total, 2) if total > 0 else 0,
+                "malePercent": pct(self.male),
+                "femalePercent": pct(self.female),
+                "statusDistribution": [
+                    {"name": label, "value": pct(self.severity[key])} for key, label in SEVERITY_LABELS
+                ],
+                "ageDistribution": [{"ageGroup": g, "count": self.ages[g]} for g in AGE_GROUPS],
+            }
+
+
+stats_aggregate = StatsAggregate()
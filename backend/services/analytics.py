@@ -0,0 +1,269 @@
+# services/analytics.py
+"""
+Columnar snapshot of the assessments table for /api/analytics.
+
+Each column is a NumPy array: categorical fields as integer codes into a
+per-column label list, scores and PHQ-8 items as small ints (-1 = missing)
+and created_at as epoch seconds. Like StatsAggregate, the snapshot catches up
+from a created_at watermark (reaching back CATCHUP_LAG_SECONDS for late
+inserts) instead of rescanning the table, so a query is a handful of
+vectorised passes over memory:
+
+    rows   = np.flatnonzero(filters combined with &)
+    key    = codes[dim1][rows] * len(labels[dim2]) + codes[dim2][rows]
+    counts = np.bincount(key, minlength=...)
+    sums   = np.bincount(key, weights=score[rows], minlength=...)
+
+Rows are append-only here: later edits to a row (e.g. status updates) are not
+picked up, which is why only fields fixed at submission time are loaded.
+"""
+import os
+import threading
+from datetime import timedelta
+import numpy as np
+from services.queries import CatchupScan, parse_timestamp
+
+CATCHUP_INTERVAL = float(os.getenv("ANALYTICS_CATCHUP_SECONDS", 30))
+PAGE_SIZE = int(os.getenv("ANALYTICS_PAGE_SIZE", 5000))
+INITIAL_CAPACITY = 1024
+
+CATEGORICAL = ["gender", "language_dialect", "recording_environment", "current_medication", "severity"]
+QUESTIONS = [f"question{i}" for i in range(1, 9)]
+# dimensions accepted by group_by and as filters; age_group is derived from age
+DIMENSIONS = CATEGORICAL + ["age_group"]
+AGE_GROUP_LABELS = ["18-24", "25-34", "35-44", "45-54", "55+"]
+MAX_GROUP_BY = 2
+MAX_GROUPS = int(os.getenv("ANALYTICS_MAX_GROUPS", 100000))
+# largest value kept per column; anything else loads as missing
+MAX_AGE = 150
+MAX_ANSWER = 3
+MAX_SCORE = MAX_ANSWER * len(QUESTIONS)
+
+SNAPSHOT_COLUMNS = ",".join(["id", "created_at", "age", "phq8_total_score"] + CATEGORICAL + QUESTIONS)
+
+
+def _small_int(value, high: int) -> int:
+    """value as an int in 0..high, or -1 (missing) if it is absent or out of range for the column's dtype."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return -1
+    return value if 0 <= value <= high else -1
+
+
+def _age_group_table() -> np.ndarray:
+    # services.aggregates.age_group as a lookup table indexed by age + 1 (ages clipped to -1..150)
+    table = np.full(152, 4, dtype=np.int8)
+    table[0] = -1
+    for code, (low, high) in enumerate([(18, 24), (25, 34), (35, 44), (45, 54)]):
+        table[low + 1:high + 2] = code
+    return table
+
+
+AGE_GROUP_TABLE = _age_group_table()
+
+
+def _age_group_codes(age: np.ndarray) -> np.ndarray:
+    """Age group code per row, -1 if the age is missing."""
+    return AGE_GROUP_TABLE[np.clip(age, -1, 150) + 1]
+
+
+def _sums_and_counts(key: np.ndarray, values: np.ndarray, counts: np.ndarray, n_groups: int):
+    """Per-group sum and number of non-missing (>= 0) values."""
+    missing = values < 0
+    if missing.any():
+        present = ~missing
+        key, values = key[present], values[present]
+        counts = np.bincount(key, minlength=n_groups)
+    if n_groups == 1:
+        return np.array([values.sum(dtype=np.int64)], dtype=np.float64), counts
+    return np.bincount(key, weights=values, minlength=n_groups), counts
+
+
+class Categories:
+    """Append-only label <-> code mapping for one column. Code 0 is always the missing value."""
+
+    def __init__(self):
+        self.labels = [None]
+        self._codes = {None: 0}
+
+    def code(self, value) -> int:
+        if isinstance(value, str):
+            value = value.strip() or None
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.labels)
+            self.labels.append(value)
+        return code
+
+
+class AnalyticsSnapshot:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scan = CatchupScan(SNAPSHOT_COLUMNS, PAGE_SIZE, CATCHUP_INTERVAL)
+        self._reset()
+
+    def _reset(self):
+        self.size = 0
+        self.categories = {c: Categories() for c in CATEGORICAL}
+        self.columns = self._allocate(INITIAL_CAPACITY)
+        self._scan.reset()
+
+    @staticmethod
+    def _allocate(capacity: int) -> dict:
+        columns = {c: np.zeros(capacity, dtype=np.int32) for c in CATEGORICAL}
+        columns["created_at"] = np.zeros(capacity, dtype=np.float64)
+        columns["age"] = np.full(capacity, -1, dtype=np.int16)
+        columns["phq8_total_score"] = np.full(capacity, -1, dtype=np.int8)
+        columns["questions"] = np.full((len(QUESTIONS), capacity), -1, dtype=np.int8)
+        return columns
+
+    def _grow(self, needed: int):
+        # caller holds self._lock. New arrays replace the old ones, so a query
+        # still reading the previous arrays sees consistent data.
+        capacity = len(self.columns["age"])
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        grown = self._allocate(capacity)
+        for name, column in self.columns.items():
+            grown[name][..., :self.size] = column[..., :self.size]
+        self.columns = grown
+
+    def _append(self, rows: list):
+        # caller holds self._lock
+        fresh = self._scan.fresh(rows)
+        if not fresh:
+            return
+
+        start, end = self.size, self.size + len(fresh)
+        self._grow(end)
+        columns = self.columns
+        for c in CATEGORICAL:
+            categories = self.categories[c]
+            columns[c][start:end] = [categories.code(r.get(c)) for r in fresh]
+        columns["created_at"][start:end] = [parse_timestamp(r["created_at"]) if r.get("created_at") else 0.0 for r in fresh]
+        # rows written before answers and ages were range-checked must not overflow the small dtypes
+        columns["age"][start:end] = [_small_int(r.get("age"), MAX_AGE) for r in fresh]
+        columns["phq8_total_score"][start:end] = [_small_int(r.get("phq8_total_score"), MAX_SCORE) for r in fresh]
+        columns["questions"][:, start:end] = [[_small_int(r.get(q), MAX_ANSWER) for r in fresh] for q in QUESTIONS]
+        self.size = end
+
+    def _append_page(self, page: list):
+        with self._lock:
+            self._append(page)
+
+    def refresh(self, force: bool = False):
+        """Load rows created since the last scan; a no-op within ANALYTICS_CATCHUP_SECONDS."""
+        self._scan.run(self._append_page, force=force)
+
+    def _clear(self):
+        with self._lock:
+            self._reset()
+
+    def rebuild(self):
+        self._scan.rebuild(self._clear, self._append_page)
+
+    def _view(self):
+        """(size, columns, labels, codes) as of now; arrays are only written past size."""
+        with self._lock:
+            n = self.size
+            columns = {name: column[..., :n] for name, column in self.columns.items()}
+            labels = {c: list(self.categories[c].labels) for c in CATEGORICAL}
+            codes = {c: dict(self.categories[c]._codes) for c in CATEGORICAL}
+        labels["age_group"] = AGE_GROUP_LABELS
+        codes["age_group"] = {label: i for i, label in enumerate(AGE_GROUP_LABELS)}
+        return n, columns, labels, codes
+
+    def query(self, filters: dict = None, group_by: list = None, date_from: float = None,
+              date_to: float = None, age_min: int = None, age_max: int = None) -> dict:
+        """
+        Count, mean PHQ-8 score and PHQ-8 item means of the rows matching the
+        filters ({dimension: [labels]}, OR within a dimension, AND across
+        dimensions), grouped by up to two dimensions. With two dimensions the
+        counts are also returned as a rows x columns cross-tab.
+        """
+        filters, group_by = filters or {}, group_by or []
+        n, columns, labels, codes = self._view()
+        if "age_group" in filters or "age_group" in group_by:
+            columns["age_group"] = _age_group_codes(columns["age"])
+
+        mask = np.ones(n, dtype=bool)
+        for dim, values in filters.items():
+            allowed = np.zeros(len(labels[dim]) + 1, dtype=bool)  # last slot: missing age group (-1)
+            allowed[[codes[dim][v] for v in values if v in codes[dim]]] = True
+            mask &= allowed[columns[dim]]
+        if date_from is not None:
+            mask &= columns["created_at"] >= date_from
+        if date_to is not None:
+            mask &= columns["created_at"] <= date_to
+        if age_min is not None:
+            mask &= columns["age"] >= age_min
+        if age_max is not None:
+            mask &= (columns["age"] >= 0) & (columns["age"] <= age_max)
+        for dim in group_by:
+            # rows without an age cannot be placed in an age group
+            if dim == "age_group":
+                mask &= columns["age_group"] >= 0
+
+        # gathering by index is much faster than boolean indexing with a sparse mask
+        rows = np.flatnonzero(mask)
+        everything = len(rows) == n
+
+        def pick(column):
+            return column if everything else column.take(rows)
+
+        # one flat group key per row: mixed-radix over the grouped dimensions
+        sizes = [len(labels[d]) for d in group_by]
+        key = np.zeros(len(rows), dtype=np.int64)
+        for dim, size in zip(group_by, sizes):
+            key = key * size + pick(columns[dim])
+        n_groups = int(np.prod(sizes)) if sizes else 1
+        if n_groups > MAX_GROUPS:
+            raise ValueError(f"too many groups: {n_groups}")
+
+        counts = np.bincount(key, minlength=n_groups)
+        score_means = _means(*_sums_and_counts(key, pick(columns["phq8_total_score"]), counts, n_groups))
+        item_means = [_means(*_sums_and_counts(key, pick(columns["questions"][i]), counts, n_groups))
+                      for i in range(len(QUESTIONS))]
+
+        groups = []
+        for g in np.flatnonzero(counts if group_by else np.ones(1)):
+            group_codes = np.unravel_index(g, sizes)
+            groups.append({
+                **{dim: labels[dim][code] for dim, code in zip(group_by, group_codes)},
+                "count": int(counts[g]),
+                "phq8Mean": _mean(score_means[g]),
+                "itemMeans": {q: _mean(item_means[i][g]) for i, q in enumerate(QUESTIONS)},
+            })
+
+        result = {"total": len(rows), "snapshotRows": n, "groupBy": group_by, "groups": groups}
+        if len(group_by) == 2:
+            rows_dim, cols_dim = group_by
+            table = counts.reshape(sizes)
+            keep_rows, keep_cols = table.any(axis=1), table.any(axis=0)
+            result["crosstab"] = {
+                "rows": [labels[rows_dim][i] for i in np.flatnonzero(keep_rows)],
+                "columns": [labels[cols_dim][i] for i in np.flatnonzero(keep_cols)],
+                "counts": table[keep_rows][:, keep_cols].tolist(),
+            }
+        return result
+
+
+def _means(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    return np.divide(sums, counts, out=np.full(len(sums), np.nan), where=counts > 0)
+
+
+def _mean(value) -> float:
+    return None if np.isnan(value) else round(float(value), 3)
+
+
+def parse_bound(value: str, end: bool = False) -> float:
+    """ISO date or datetime as epoch seconds; a bare date as an end bound covers that whole day."""
+    if end and len(value) == 10:
+        return parse_timestamp(value) + timedelta(days=1).total_seconds() - 1e-6
+    return parse_timestamp(value)
+
+
+analytics_snapshot = AnalyticsSnapshot()
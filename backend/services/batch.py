@@ -0,0 +1,162 @@
+# services/batch.py
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from services.supabase_client import get_supabase
+from services.storage import upload_audio_base64, upload_audio_file, stored_audio_path
+from services.submissions import validate_submission, build_record, assessment_id_for
+from services.upload_queue import upload_queue
+from services.upload_sessions import upload_sessions, UploadNotFound, UploadIncomplete
+from services.aggregates import stats_aggregate
+from services.stats_stream import stats_hub
+from services.cache import invalidate_assessment
+
+ASSESSMENTS_TABLE = os.getenv("ASSESSMENTS_TABLE", "voice_assessments")
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+BATCH_UPLOAD_WORKERS = int(os.getenv("BATCH_UPLOAD_WORKERS", 4))
+
+logger = logging.getLogger(__name__)
+
+
+def _upload_session(item):
+    """
+    audioUploadId: upload the finalized session's file, or reuse a stored copy.
+    The session is kept on item["session"]; process_batch spools or discards
+    it once the row is written, so a failed batch can be retried with it.
+    """
+    aid, data = item["aid"], item["data"]
+    try:
+        session = upload_sessions.finalized(data["audioUploadId"])
+    except UploadNotFound:
+        return None, None, "upload_not_found"
+    except UploadIncomplete:
+        return None, None, "upload_not_finalized"
+    if data.get("audioSha256") and data["audioSha256"] != session["sha256"]:
+        return None, None, "invalid_audio_data"
+    item["session"] = session
+    storage_path = stored_audio_path(session["sha256"])
+    if storage_path:
+        return storage_path, "submitted", None
+    try:
+        return upload_audio_file(upload_sessions.data_path(session["id"]), session["content_type"]), "submitted", None
+    except Exception as e:
+        logger.warning("batch audio upload error for %s, spooling: %s", aid, e)
+        return None, "audio_pending", None
+
+
+def _upload(item):
+    """Returns (storage_path, status, error) for one validated item."""
+    aid, data = item["aid"], item["data"]
+    audio, audio_sha256 = data.get("audioData"), data.get("audioSha256")
+    if data.get("audioUploadId") and not audio:
+        return _upload_session(item)
+    try:
+        if audio_sha256:
+            storage_path = stored_audio_path(audio_sha256)
+            if storage_path:
+                return storage_path, "submitted", None
+            if not audio:
+                return None, None, "audio_not_found"
+        if not audio:
+            return None, "submitted", None
+        return upload_audio_base64(audio, expected_sha256=audio_sha256), "submitted", None
+    except ValueError:
+        return None, None, "invalid_audio_data"
+    except Exception as e:
+        # keep the recording: spool it and let the background queue retry
+        logger.warning("batch audio upload error for %s, spooling: %s", aid, e)
+        try:
+            if upload_queue.spool_base64(aid, audio):
+                return None, "audio_pending", None
+        except Exception:
+            logger.exception("batch spool error for %s", aid)
+        return None, "submitted", None
+
+
+def process_batch(items: list) -> dict:
+    """
+    Validate, upload and insert a batch of offline submissions.
+
+    Every item needs a clientId; the assessment id is derived from it, so a
+    retried sync reports already-stored items as "duplicate" instead of
+    inserting them again. Audio for new items is uploaded in parallel by a
+    bounded pool and all rows are written with one bulk upsert.
+    """
+    results = [None] * len(items)
+    pending = []
+    seen = set()
+
+    for i, data in enumerate(items):
+        client_id = data.get("clientId") if isinstance(data, dict) else None
+        if not client_id:
+            results[i] = {"clientId": client_id, "status": "error", "error": "missing_clientId"}
+            continue
+        aid = assessment_id_for(client_id)
+        if aid in seen:
+            results[i] = {"clientId": client_id, "testId": aid, "status": "duplicate"}
+            continue
+        seen.add(aid)
+        error, cleaned = validate_submission(data)
+        if error:
+            results[i] = {"clientId": client_id, "status": "error", "error": error}
+            continue
+        pending.append({"index": i, "clientId": client_id, "aid": aid, "data": data, "cleaned": cleaned})
+
+    if pending:
+        res = get_supabase().table(ASSESSMENTS_TABLE).select("id").in_("id", [p["aid"] for p in pending]).execute()
+        existing = {r["id"] for r in (res.data or [])}
+        fresh = []
+        for p in pending:
+            if p["aid"] in existing:
+                results[p["index"]] = {"clientId": p["clientId"], "testId": p["aid"], "status": "duplicate"}
+            else:
+                fresh.append(p)
+        pending = fresh
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS) as pool:
+            uploads = list(pool.map(_upload, pending))
+
+        records, inserted = [], []
+        for p, (storage_path, status, error) in zip(pending, uploads):
+            if error:
+                results[p["index"]] = {"clientId": p["clientId"], "status": "error", "error": error}
+                continue
+            records.append(build_record(p["aid"], p["data"], p["cleaned"], storage_path, status=status))
+            inserted.append(p)
+
+        if records:
+            try:
+                # ignore_duplicates covers a concurrent retry of the same batch
+                get_supabase().table(ASSESSMENTS_TABLE).upsert(records, on_conflict="id", ignore_duplicates=True).execute()
+            except Exception:
+                for p, record in zip(inserted, records):
+                    if record["status"] == "audio_pending" and "session" not in p:
+                        upload_queue.discard(record["id"])
+                raise
+            for p, record in zip(inserted, records):
+                stats_aggregate.record(record)
+                session = p.get("session")
+                if session is not None:
+                    if record["status"] == "audio_pending":
+                        upload_sessions.move_data(session["id"], upload_queue.spool_path(record["id"]))
+                        upload_queue.submit(record["id"], session["content_type"])
+                    upload_sessions.discard(session["id"])
+                elif record["status"] == "audio_pending":
+                    upload_queue.submit(record["id"])
+                results[p["index"]] = {
+                    "clientId": p["clientId"],
+                    "testId": record["id"],
+                    "status": record["status"],
+                    "phq8Score": p["cleaned"]["score"],
+                    "severity": p["cleaned"]["severity"]
+                }
+            stats_hub.notify()
+            invalidate_assessment()
+
+    return {
+        "results": results,
+        "inserted": sum(1 for r in results if r["status"] in ("submitted", "audio_pending")),
+        "duplicates": sum(1 for r in results if r["status"] == "duplicate"),
+        "errors": sum(1 for r in results if r["status"] == "error"),
+    }
@@ -0,0 +1,175 @@
+# services/cache.py
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import request, current_app, make_response
+
+CACHE_TTL = float(os.getenv("CACHE_TTL_SECONDS", 30))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+CACHE_URL = os.getenv("CACHE_URL") or os.getenv("REDIS_URL")
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """In-process LRU cache with per-entry TTL. Values are stored as-is."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float = CACHE_TTL):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class RedisCache:
+    """Shared cache for multiple workers/instances. Values must be JSON-serialisable."""
+
+    def __init__(self, url: str, namespace: str = "echomind:"):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        raw = self._redis.get(self.namespace + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl: float = CACHE_TTL):
+        self._redis.set(self.namespace + key, json.dumps(value), px=int(ttl * 1000))
+
+    def delete(self, key):
+        self.invalidations += self._redis.delete(self.namespace + key)
+
+    def delete_prefix(self, prefix: str):
+        keys = list(self._redis.scan_iter(match=self.namespace + prefix + "*"))
+        if keys:
+            self.invalidations += self._redis.delete(*keys)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+def make_cache():
+    if CACHE_URL:
+        try:
+            return RedisCache(CACHE_URL)
+        except Exception as e:
+            # redis not installed or unreachable: fall back to per-process cache
+            logger.warning("shared cache unavailable, using in-process LRU: %s", e)
+    return LRUCache()
+
+
+cache = make_cache()
+
+
+def invalidate_assessment(aid: str = None):
+    """Drop cached reads affected by a new or changed assessment."""
+    try:
+        cache.delete("stats")
+        cache.delete_prefix("assessments:")
+        if aid:
+            cache.delete(f"assessment:{aid}")
+    except Exception as e:
+        logger.warning("cache invalidation error: %s", e)
+
+
+def lookup_entry(key: str):
+    """Cached {"body", "etag"} for key, or None (also when the cache is down)."""
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning("cache read error: %s", e)
+        return None
+
+
+def store_entry(key: str, body: str, ttl: float = CACHE_TTL) -> dict:
+    entry = {"body": body, "etag": hashlib.sha256(body.encode()).hexdigest()[:32]}
+    try:
+        cache.set(key, entry, ttl)
+    except Exception as e:
+        logger.warning("cache write error: %s", e)
+    return entry
+
+
+def cached_json(key: str, producer, ttl: float = CACHE_TTL):
+    """
+    Serve a JSON response from the cache with a strong ETag.
+
+    producer() returns (payload, status) and is only called on a miss. Only
+    200 responses are cached. A matching If-None-Match gets a 304 without
+    calling the producer, i.e. without a database round-trip.
+    """
+    entry = lookup_entry(key)
+    if entry is None:
+        payload, status = producer()
+        body = current_app.json.dumps(payload)
+        if status != 200:
+            return current_app.response_class(body, status=status, mimetype="application/json")
+        entry = store_entry(key, body, ttl)
+
+    if request.if_none_match.contains(entry["etag"]):
+        resp = make_response("", 304)
+    else:
+        resp = current_app.response_class(entry["body"], status=200, mimetype="application/json")
+    resp.set_etag(entry["etag"])
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
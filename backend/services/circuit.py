@@ -0,0 +1,128 @@
+# services/circuit.py
+"""
+Circuit breaker for calls to Supabase.
+
+Every HTTP request to Supabase goes through BreakerTransport (see
+services/supabase_client.py). After SUPABASE_BREAKER_FAILURES consecutive
+failures (connection errors, timeouts or 5xx responses; other exceptions,
+such as a failing request-body stream, are not Supabase's fault and do not
+count) the circuit opens and calls fail immediately with CircuitOpen instead of waiting on timeouts. After
+SUPABASE_BREAKER_RESET_SECONDS one trial call is let through: success closes
+the circuit, failure opens it again. Routes answer CircuitOpen with a 503 and
+Retry-After. State is per process.
+"""
+import os
+import math
+import time
+import threading
+import httpx
+
+FAILURE_THRESHOLD = int(os.getenv("SUPABASE_BREAKER_FAILURES", 5))
+RESET_SECONDS = float(os.getenv("SUPABASE_BREAKER_RESET_SECONDS", 30))
+
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"Supabase is unavailable, retry in {self.retry_after}s")
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_seconds: float = RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def retry_after(self) -> float:
+        """Seconds until calls are allowed again; 0 when the circuit is closed or due for a trial."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def before_call(self):
+        """Raise CircuitOpen unless the call may go ahead."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            wait = self._opened_at + self.reset_seconds - time.monotonic()
+            if wait > 0:
+                raise CircuitOpen(wait)
+            if self._trial:
+                # another call is already probing; it decides for everyone
+                raise CircuitOpen(1)
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def record_abandoned(self):
+        """The call ended without telling us anything about Supabase: no verdict, but free the trial slot."""
+        with self._lock:
+            self._trial = False
+
+
+supabase_breaker = CircuitBreaker()
+
+
+class BreakerTransport(httpx.HTTPTransport):
+    def handle_request(self, request):
+        supabase_breaker.before_call()
+        try:
+            response = super().handle_request(request)
+        except httpx.TransportError:
+            # connection errors and timeouts: Supabase did not answer
+            supabase_breaker.record_failure()
+            raise
+        except BaseException:
+            # not Supabase's fault (the request body's stream failed, a client
+            # went away, the task was cancelled): no verdict, but free the trial slot
+            supabase_breaker.record_abandoned()
+            raise
+        if response.status_code >= 500:
+            supabase_breaker.record_failure()
+        else:
+            supabase_breaker.record_success()
+        return response
+
+
+class AsyncBreakerTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request):
+        supabase_breaker.before_call()
+        try:
+            response = await super().handle_async_request(request)
+        except httpx.TransportError:
+            # connection errors and timeouts: Supabase did not answer
+            supabase_breaker.record_failure()
+            raise
+        except BaseException:
+            # not Supabase's fault (the request body's stream failed, a client
+            # went away, the task was cancelled): no verdict, but free the trial slot
+            supabase_breaker.record_abandoned()
+            raise
+        if response.status_code >= 500:
+            supabase_breaker.record_failure()
+        else:
+            supabase_breaker.record_success()
+        return response
@@ -0,0 +1,294 @@
+# services/export.py
+"""
+Streaming dataset export.
+
+Assessments are read as keyset pages (oldest first) and encoded page by page,
+so memory use depends on the page size, not on the size of the table. Every
+page boundary has a cursor; passing it back resumes the export after the last
+row that was written.
+
+CLI:
+    python -m services.export --format ndjson --out dataset.ndjson
+    python -m services.export --format ndjson --out dataset.ndjson --resume
+"""
+import io
+import os
+import csv
+import json
+import logging
+import tarfile
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from services.supabase_client import get_supabase
+from services.storage import BUCKET, AUDIO_EXTENSIONS
+from services.queries import ASSESSMENT_COLUMNS, fetch_assessment_page, encode_cursor
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 500))
+EXPORT_AUDIO_PAGE_SIZE = int(os.getenv("EXPORT_AUDIO_PAGE_SIZE", 50))
+EXPORT_DOWNLOAD_WORKERS = int(os.getenv("EXPORT_DOWNLOAD_WORKERS", 8))
+
+logger = logging.getLogger(__name__)
+
+# full_name is identifying and audio_url is a short-lived signed link; neither
+# belongs in a research dump unless asked for explicitly via fields=
+DEFAULT_EXPORT_COLUMNS = [c for c in ASSESSMENT_COLUMNS if c not in ("full_name", "audio_url")]
+FORMATS = ("ndjson", "csv", "parquet", "zip", "tar")
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+}
+INT_COLUMNS = {"age", "phq8_total_score"} | {f"question{i}" for i in range(1, 9)}
+
+
+def iter_pages(columns: list, cursor: str = None, page_size: int = EXPORT_PAGE_SIZE):
+    """Yield (rows, cursor_after_page) in ascending (created_at, id) order."""
+    select = ",".join(dict.fromkeys(["id", "created_at"] + columns))
+    while True:
+        rows, next_cursor = fetch_assessment_page(select, page_size, cursor, desc=False)
+        if not rows:
+            return
+        yield rows, encode_cursor(rows[-1])
+        if next_cursor is None:
+            return
+        cursor = next_cursor
+
+
+def _flat(row: dict, columns: list) -> dict:
+    out = {}
+    for c in columns:
+        value = row.get(c)
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        out[c] = value
+    return out
+
+
+# ---- encoders: each takes an iterator of (rows, cursor) and yields (bytes, cursor) ----
+
+def ndjson_chunks(pages, columns):
+    for rows, cursor in pages:
+        lines = [json.dumps({c: r.get(c) for c in columns}, ensure_ascii=False) for r in rows]
+        yield ("\n".join(lines) + "\n").encode("utf-8"), cursor
+
+
+def csv_chunks(pages, columns, header: bool = True):
+    if header:
+        buf = io.StringIO()
+        csv.writer(buf).writerow(columns)
+        yield buf.getvalue().encode("utf-8"), None
+    for rows, cursor in pages:
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+        writer.writerows(_flat(r, columns) for r in rows)
+        yield buf.getvalue().encode("utf-8"), cursor
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable file object whose contents are drained by the caller."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_chunks(pages, columns):
+    """One Parquet row group per page. Requires pyarrow (optional dependency)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def arrow_type(c):
+        if c in INT_COLUMNS:
+            return pa.int64()
+        if c == "has_audio":
+            return pa.bool_()
+        return pa.string()
+
+    schema = pa.schema([(c, arrow_type(c)) for c in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows, cursor in pages:
+            flat = [_flat(r, columns) for r in rows]
+            table = pa.Table.from_pylist(flat, schema=schema)
+            writer.write_table(table)
+            yield sink.drain(), cursor
+    finally:
+        writer.close()
+    yield sink.drain(), None
+
+
+# leading bytes of the formats browsers record in, for objects stored without a content type
+AUDIO_SIGNATURES = [(b"\x1a\x45\xdf\xa3", "webm"), (b"OggS", "ogg"), (b"RIFF", "wav"), (b"ID3", "mp3")]
+
+
+def _download(path: str):
+    try:
+        return get_supabase().storage.from_(BUCKET).download(path)
+    except Exception as e:
+        logger.warning("export: could not download %s: %s", path, e)
+        return None
+
+
+def _stored_content_type(path: str):
+    """Content type the object was uploaded with (list() reports it as metadata.mimetype), or None."""
+    folder, name = path.rsplit("/", 1)
+    try:
+        items = get_supabase().storage.from_(BUCKET).list(folder, {"search": name})
+    except Exception as e:
+        logger.warning("export: could not look up %s: %s", path, e)
+        return None
+    for item in items or []:
+        if item.get("name") == name:
+            return (item.get("metadata") or {}).get("mimetype")
+    return None
+
+
+def _sniff_extension(blob: bytes):
+    for signature, ext in AUDIO_SIGNATURES:
+        if blob.startswith(signature):
+            return ext
+    if blob[4:8] == b"ftyp":
+        return "m4a"
+    return None
+
+
+def _fetch(path: str):
+    """(bytes, extension or None) of a recording; bytes is None if it could not be downloaded."""
+    blob = _download(path)
+    if blob is None:
+        return None, None
+    name = path.rsplit("/", 1)[-1]
+    if "." in name:
+        # per-assessment uploads carry the extension of their content type
+        return blob, name.rsplit(".", 1)[-1]
+    # content-addressed recordings are stored under the bare hash
+    content_type = (_stored_content_type(path) or "").split(";", 1)[0].strip().lower()
+    return blob, AUDIO_EXTENSIONS.get(content_type) or _sniff_extension(blob)
+
+
+def _recordings(pages):
+    """Yield (items, cursor) with items as (row, bytes, extension); each page's files are fetched concurrently."""
+    with ThreadPoolExecutor(max_workers=EXPORT_DOWNLOAD_WORKERS) as pool:
+        for rows, cursor in pages:
+            with_audio = [r for r in rows if r.get("audio_path")]
+            fetched = pool.map(_fetch, [r["audio_path"] for r in with_audio])
+            yield [(r, b, ext) for r, (b, ext) in zip(with_audio, fetched) if b is not None], cursor
+
+
+def _member_name(row: dict, ext: str) -> str:
+    # without a known format the member gets no extension rather than a wrong one
+    return f"recordings/{row['id']}.{ext}" if ext else f"recordings/{row['id']}"
+
+
+def zip_chunks(pages):
+    """Stream a ZIP of recordings. Audio is already compressed, so members are stored."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        for items, cursor in _recordings(pages):
+            for row, blob, ext in items:
+                zf.writestr(_member_name(row, ext), blob)
+            yield sink.drain(), cursor
+    yield sink.drain(), None
+
+
+def tar_chunks(pages):
+    sink = _ChunkSink()
+    with tarfile.open(fileobj=sink, mode="w|") as tf:
+        for items, cursor in _recordings(pages):
+            for row, blob, ext in items:
+                info = tarfile.TarInfo(_member_name(row, ext))
+                info.size = len(blob)
+                tf.addfile(info, io.BytesIO(blob))
+            yield sink.drain(), cursor
+    yield sink.drain(), None
+
+
+def export_chunks(fmt: str, columns: list = None, cursor: str = None):
+    """Yield (bytes, cursor) for the given format; cursor is None for non-resumable chunks."""
+    columns = columns or DEFAULT_EXPORT_COLUMNS
+    if fmt == "ndjson":
+        return ndjson_chunks(iter_pages(columns, cursor), columns)
+    if fmt == "csv":
+        return csv_chunks(iter_pages(columns, cursor), columns, header=cursor is None)
+    if fmt == "parquet":
+        return parquet_chunks(iter_pages(columns, cursor), columns)
+    if fmt == "zip":
+        return zip_chunks(iter_pages(["audio_path"], cursor, EXPORT_AUDIO_PAGE_SIZE))
+    if fmt == "tar":
+        return tar_chunks(iter_pages(["audio_path"], cursor, EXPORT_AUDIO_PAGE_SIZE))
+    raise ValueError(f"unknown format: {fmt}")
+
+
+# ---- CLI ----
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the voice assessment dataset")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--out", required=True, help="output file")
+    parser.add_argument("--fields", help="comma separated columns (tabular formats)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from <out>.cursor left by an interrupted run")
+    args = parser.parse_args(argv)
+
+    # checkpoint: cursor after the last complete page and the output size at that point
+    checkpoint = args.out + ".cursor"
+    state = None
+    if args.resume and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            state = json.load(f)
+    cursor = state["cursor"] if state else None
+
+    out_path = args.out
+    if state and args.format in ("parquet", "zip", "tar"):
+        # these containers end with a footer/index and cannot be appended to,
+        # so a resumed run writes the remaining rows to a new part file
+        part = 1
+        while os.path.exists(f"{args.out}.part{part}"):
+            part += 1
+        out_path = f"{args.out}.part{part}"
+        state = None
+
+    columns = [c.strip() for c in args.fields.split(",")] if args.fields else None
+    if columns and any(c not in ASSESSMENT_COLUMNS for c in columns):
+        parser.error(f"--fields must be a subset of: {', '.join(ASSESSMENT_COLUMNS)}")
+    pages = 0
+    with open(out_path, "r+b" if state else "wb") as out:
+        if state:
+            # drop anything written after the last checkpoint (e.g. a half-written page)
+            out.truncate(state["offset"])
+            out.seek(state["offset"])
+        for data, page_cursor in export_chunks(args.format, columns, cursor):
+            out.write(data)
+            if page_cursor:
+                out.flush()
+                with open(checkpoint, "w") as f:
+                    json.dump({"cursor": page_cursor, "offset": out.tell()}, f)
+                pages += 1
+
+    if os.path.exists(checkpoint):
+        os.unlink(checkpoint)
+    print(f"export complete: {out_path} ({pages} pages)")
+
+
+if __name__ == "__main__":
+    main()
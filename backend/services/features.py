@@ -0,0 +1,287 @@
+# services/features.py
+"""
+Offline audio feature extraction.
+
+Recordings are decoded to 16 kHz mono, framed (25 ms window, 10 ms hop) and
+turned into log-mel spectrograms and MFCCs with vectorised NumPy over all
+frames at once. Extraction runs in a process pool; results are appended to a
+sharded store of .npy files that training jobs open with mmap_mode="r":
+
+    <store>/index.json                    {assessment_id: {shard, offset, frames, duration, rms}}
+    <store>/shard-00001/logmel.npy        float32 [frames, N_MELS]
+    <store>/shard-00001/mfcc.npy          float32 [frames, N_MFCC]
+
+Only recordings missing from the index are processed, so the backfill can be
+re-run (e.g. from cron) after new uploads.
+
+CLI:
+    python -m services.features backfill --store features --workers 4
+"""
+import io
+import os
+import json
+import wave
+import logging
+import shutil
+import argparse
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "features")
+SAMPLE_RATE = 16000
+FRAME_LENGTH = 400   # 25 ms
+HOP_LENGTH = 160     # 10 ms
+N_FFT = 512
+N_MELS = 64
+N_MFCC = 13
+SHARD_RECORDINGS = int(os.getenv("FEATURE_SHARD_RECORDINGS", 256))
+
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedAudio(Exception):
+    pass
+
+
+# ---- decoding ----
+
+def _decode_wav(data: bytes):
+    with wave.open(io.BytesIO(data)) as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise UnsupportedAudio(f"unsupported sample width: {width}")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def _decode_ffmpeg(data: bytes):
+    """webm/ogg/mp4 recordings from browsers; needs an ffmpeg binary on PATH."""
+    if not shutil.which("ffmpeg"):
+        raise UnsupportedAudio("ffmpeg not available for compressed audio")
+    proc = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False,
+    )
+    if proc.returncode != 0:
+        raise UnsupportedAudio(proc.stderr.decode(errors="replace").strip() or "ffmpeg failed")
+    return np.frombuffer(proc.stdout, dtype="<i2").astype(np.float32) / 32768.0, SAMPLE_RATE
+
+
+def decode_audio(data: bytes, path: str = ""):
+    """Return mono float32 samples at SAMPLE_RATE."""
+    if data[:4] == b"RIFF" or path.endswith(".wav"):
+        samples, rate = _decode_wav(data)
+    else:
+        samples, rate = _decode_ffmpeg(data)
+    if rate != SAMPLE_RATE and len(samples):
+        target = int(round(len(samples) * SAMPLE_RATE / rate))
+        samples = np.interp(
+            np.linspace(0, len(samples) - 1, target), np.arange(len(samples)), samples
+        ).astype(np.float32)
+    return samples
+
+
+# ---- features ----
+
+def _mel_filterbank():
+    def hz_to_mel(f):
+        return 2595.0 * np.log10(1.0 + f / 700.0)
+
+    def mel_to_hz(m):
+        return 700.0 * (10 ** (m / 2595.0) - 1.0)
+
+    mels = np.linspace(hz_to_mel(0.0), hz_to_mel(SAMPLE_RATE / 2), N_MELS + 2)
+    bins = np.floor((N_FFT + 1) * mel_to_hz(mels) / SAMPLE_RATE).astype(int)
+    fb = np.zeros((N_MELS, N_FFT // 2 + 1), dtype=np.float32)
+    for m in range(1, N_MELS + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            fb[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            fb[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return fb
+
+
+def _dct_matrix():
+    # orthonormal DCT-II, first N_MFCC coefficients
+    n = np.arange(N_MELS)
+    k = np.arange(N_MFCC)[:, None]
+    dct = np.cos(np.pi / N_MELS * (n + 0.5) * k) * np.sqrt(2.0 / N_MELS)
+    dct[0] /= np.sqrt(2.0)
+    return dct.astype(np.float32)
+
+
+MEL_FB = _mel_filterbank()
+DCT = _dct_matrix()
+WINDOW = np.hanning(FRAME_LENGTH).astype(np.float32)
+
+
+def compute_features(samples: np.ndarray) -> dict:
+    """log-mel [frames, N_MELS], MFCC [frames, N_MFCC], duration (s) and RMS energy."""
+    if len(samples) < FRAME_LENGTH:
+        samples = np.pad(samples, (0, FRAME_LENGTH - len(samples)))
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_LENGTH)[::HOP_LENGTH]
+    power = np.abs(np.fft.rfft(frames * WINDOW, n=N_FFT, axis=1)) ** 2 / N_FFT
+    logmel = np.log(np.maximum(power @ MEL_FB.T, 1e-10)).astype(np.float32)
+    mfcc = (logmel @ DCT.T).astype(np.float32)
+    return {
+        "logmel": logmel,
+        "mfcc": mfcc,
+        "duration": float(len(samples) / SAMPLE_RATE),
+        "rms": float(np.sqrt(np.mean(np.square(samples, dtype=np.float64)))) if len(samples) else 0.0,
+    }
+
+
+def _extract(item):
+    """Process-pool entry point: (aid, path, bytes) -> (aid, features or None, error)."""
+    aid, path, data = item
+    try:
+        return aid, compute_features(decode_audio(data, path)), None
+    except Exception as e:
+        return aid, None, str(e)
+
+
+# ---- store ----
+
+class FeatureStore:
+    def __init__(self, root: str = FEATURE_STORE_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def load_index(self) -> dict:
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, aid: str, index: dict = None):
+        """Zero-copy (logmel, mfcc) views for one recording, or None."""
+        entry = (index or self.load_index()).get(aid)
+        if entry is None:
+            return None
+        shard = self._open_shard(entry["shard"])
+        start, stop = entry["offset"], entry["offset"] + entry["frames"]
+        return shard["logmel"][start:stop], shard["mfcc"][start:stop]
+
+    def _open_shard(self, name: str):
+        with self._lock:
+            if name not in self._shards:
+                base = os.path.join(self.root, name)
+                self._shards[name] = {
+                    "logmel": np.load(os.path.join(base, "logmel.npy"), mmap_mode="r"),
+                    "mfcc": np.load(os.path.join(base, "mfcc.npy"), mmap_mode="r"),
+                }
+            return self._shards[name]
+
+    def write_shard(self, results: list) -> int:
+        """Append one shard for [(aid, features)] and merge it into the index."""
+        if not results:
+            return 0
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self.load_index()
+            results = [(aid, feats) for aid, feats in results if aid not in index]
+            if not results:
+                return 0
+            numbers = [int(d[len("shard-"):]) for d in os.listdir(self.root)
+                       if d.startswith("shard-") and d[len("shard-"):].isdigit()]
+            name = f"shard-{max(numbers, default=0) + 1:05d}"
+            tmp = os.path.join(self.root, name + ".tmp")
+            os.makedirs(tmp, exist_ok=True)
+            np.save(os.path.join(tmp, "logmel.npy"), np.concatenate([f["logmel"] for _, f in results]))
+            np.save(os.path.join(tmp, "mfcc.npy"), np.concatenate([f["mfcc"] for _, f in results]))
+            os.replace(tmp, os.path.join(self.root, name))
+
+            offset = 0
+            for aid, feats in results:
+                frames = len(feats["logmel"])
+                index[aid] = {"shard": name, "offset": offset, "frames": frames,
+                              "duration": feats["duration"], "rms": feats["rms"]}
+                offset += frames
+            with open(self.index_path + ".tmp", "w") as f:
+                json.dump(index, f)
+            os.replace(self.index_path + ".tmp", self.index_path)
+            return len(results)
+
+
+# ---- backfill ----
+
+def backfill(store: FeatureStore, workers: int = None, download_workers: int = 8) -> dict:
+    """Extract features for every recording that is not in the store yet."""
+    from services.supabase_client import get_supabase
+    from services.storage import BUCKET
+    from services.queries import iter_assessments
+
+    def download(row):
+        try:
+            return row["id"], row["audio_path"], get_supabase().storage.from_(BUCKET).download(row["audio_path"])
+        except Exception as e:
+            logger.warning("features: could not download %s: %s", row["audio_path"], e)
+            return None
+
+    done = set(store.load_index())
+    counts = {"processed": 0, "skipped": 0, "failed": 0}
+    batch = []
+
+    def flush(pool):
+        results = []
+        for aid, feats, error in pool.map(_extract, batch):
+            if feats is None:
+                counts["failed"] += 1
+                logger.warning("features: skipped %s: %s", aid, error)
+            else:
+                results.append((aid, feats))
+        counts["processed"] += store.write_shard(results)
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(download_workers) as io_pool:
+        for page in iter_assessments("id,created_at,audio_path"):
+            todo = [r for r in page if r.get("audio_path") and r["id"] not in done]
+            counts["skipped"] += len(page) - len(todo)
+            for item in io_pool.map(download, todo):
+                if item is None:
+                    counts["failed"] += 1
+                    continue
+                batch.append(item)
+                if len(batch) >= SHARD_RECORDINGS:
+                    flush(pool)
+        if batch:
+            flush(pool)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audio feature extraction")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bf = sub.add_parser("backfill", help="extract features for recordings missing from the store")
+    bf.add_argument("--store", default=FEATURE_STORE_DIR)
+    bf.add_argument("--workers", type=int, default=None, help="extraction processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill":
+        counts = backfill(FeatureStore(args.store), workers=args.workers)
+        print(f"features: {counts['processed']} processed, {counts['skipped']} skipped, {counts['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# services/health.py
+"""
+Cached health check and worker warmup.
+
+The platform polls /api/health every few seconds. Rather than querying the
+table on every poll, each worker probes Supabase with a one-row primary key
+read at most every HEALTH_CHECK_INTERVAL_SECONDS and serves the last result
+in between.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from services.supabase_client import get_supabase
+from services.circuit import CircuitOpen
+
+ASSESSMENTS_TABLE = os.getenv("ASSESSMENTS_TABLE", "voice_assessments")
+CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", 15))
+
+logger = logging.getLogger(__name__)
+
+
+class HealthCheck:
+    def __init__(self, interval: float = CHECK_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._result = None
+        self._checked_at = 0.0
+
+    def probe(self) -> dict:
+        start = time.perf_counter()
+        timestamp = datetime.utcnow().isoformat()
+        try:
+            get_supabase().table(ASSESSMENTS_TABLE).select("id").limit(1).execute()
+        except CircuitOpen as e:
+            return {"status": "unhealthy", "db": "circuit_open", "retryAfter": e.retry_after, "timestamp": timestamp}
+        except Exception as e:
+            return {"status": "unhealthy", "error": str(e), "timestamp": timestamp}
+        return {"status": "healthy", "db": "connected", "timestamp": timestamp,
+                "latencyMs": round((time.perf_counter() - start) * 1000, 1)}
+
+    def get(self) -> dict:
+        """
+        The last result, re-probing once it is older than the interval. One
+        thread probes at a time; concurrent callers get the previous result.
+        """
+        if self._result is not None and time.monotonic() - self._checked_at < self.interval:
+            return self._result
+        if not self._lock.acquire(blocking=self._result is None):
+            return self._result
+        try:
+            if self._result is None or time.monotonic() - self._checked_at >= self.interval:
+                self._result = self.probe()
+                self._checked_at = time.monotonic()
+            return self._result
+        finally:
+            self._lock.release()
+
+
+health_check = HealthCheck()
+
+
+def _load_stats():
+    from services.aggregates import stats_aggregate
+    from services.analytics import analytics_snapshot
+    try:
+        stats_aggregate.refresh()
+    except Exception:
+        logger.exception("stats warmup failed")
+    try:
+        analytics_snapshot.refresh()
+    except Exception:
+        logger.exception("analytics warmup failed")
+
+
+def warmup():
+    """
+    Worker boot hook (gunicorn.conf.py): create this worker's client and open
+    a pooled connection before the first request, start the audio upload
+    workers so recordings spooled before a restart are uploaded, and load the
+    stats counters and the analytics snapshot in the background so the first
+    /api/stats or /api/analytics does not pay for the scan.
+    """
+    from services.upload_queue import upload_queue
+    result = health_check.get()
+    if result["status"] != "healthy":
+        logger.warning("warmup: Supabase unhealthy: %s", result.get("error") or result.get("db"))
+    upload_queue.start()
+    threading.Thread(target=_load_stats, name="stats-warmup", daemon=True).start()
@@ -0,0 +1,418 @@
+# services/local_backend.py
+"""
+In-process stand-in for the parts of the Supabase client this backend uses.
+
+Tables live in SQLite (":memory:" by default, or LOCAL_DB_PATH) and bucket
+objects on the local filesystem (LOCAL_STORAGE_DIR). LOCAL_DB_LATENCY_MS and
+LOCAL_STORAGE_LATENCY_MS inject a fixed delay per call to approximate network
+round-trips. Enabled with DATA_BACKEND=local; used by the benchmark suite and
+for running the app offline. AsyncLocalClient gives the same data an awaitable
+interface (asyncio.sleep for the delay) for the ASGI serving mode.
+"""
+import os
+import asyncio
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+from types import SimpleNamespace
+
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", ":memory:")
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", os.path.join(tempfile.gettempdir(), "echomind_local_storage"))
+DB_LATENCY = float(os.getenv("LOCAL_DB_LATENCY_MS", 0)) / 1000.0
+STORAGE_LATENCY = float(os.getenv("LOCAL_STORAGE_LATENCY_MS", 0)) / 1000.0
+
+OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def _ident(name: str) -> str:
+    if not name.replace("_", "").isalnum():
+        raise ValueError(f"invalid identifier: {name}")
+    return f'"{name}"'
+
+
+def _encode(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+# ---- PostgREST logic trees: "a.gt.1,and(b.eq.\"x\",c.lt.2)" ----
+
+def _split_top(expr: str):
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(expr):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append(expr[start:i])
+            start = i + 1
+    parts.append(expr[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _logic_sql(expr: str, joiner: str, params: list) -> str:
+    clauses = []
+    for part in _split_top(expr):
+        if part.startswith("and(") or part.startswith("or("):
+            op, inner = part.split("(", 1)
+            clauses.append(_logic_sql(inner[:-1], " AND " if op == "and" else " OR ", params))
+            continue
+        column, op, value = part.split(".", 2)
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        clauses.append(f"{_ident(column)} {OPERATORS[op]} ?")
+        params.append(value)
+    return "(" + joiner.join(clauses) + ")"
+
+
+class LocalDatabase:
+    def __init__(self, path: str = LOCAL_DB_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._columns = {}
+        self._json_columns = {}
+
+    def columns(self, table: str) -> list:
+        if table not in self._columns:
+            rows = self._conn.execute(f"PRAGMA table_info({_ident(table)})").fetchall()
+            self._columns[table] = [r["name"] for r in rows]
+        return self._columns[table]
+
+    def ensure_columns(self, table: str, records: list):
+        existing = self.columns(table)
+        wanted = list(dict.fromkeys(k for r in records for k in r))
+        json_cols = self._json_columns.setdefault(table, {"consent_data"})
+        for r in records:
+            json_cols.update(k for k, v in r.items() if isinstance(v, (dict, list)))
+        if not existing:
+            cols = ", ".join(f"{_ident(c)}{' PRIMARY KEY' if c == 'id' else ''}" for c in wanted)
+            self._conn.execute(f"CREATE TABLE {_ident(table)} ({cols})")
+            if "created_at" in wanted and "id" in wanted:
+                self._conn.execute(f'CREATE INDEX "{table}_created_id" ON {_ident(table)} (created_at, id)')
+        else:
+            for c in wanted:
+                if c not in existing:
+                    self._conn.execute(f"ALTER TABLE {_ident(table)} ADD COLUMN {_ident(c)}")
+        self._columns.pop(table, None)
+
+    def decode(self, table: str, row: sqlite3.Row) -> dict:
+        out = dict(row)
+        for c in self._json_columns.get(table, ("consent_data",)):
+            if isinstance(out.get(c), str):
+                out[c] = json.loads(out[c])
+        if "has_audio" in out and out["has_audio"] is not None:
+            out["has_audio"] = bool(out["has_audio"])
+        return out
+
+
+class LocalQuery:
+    def __init__(self, db: LocalDatabase, table: str):
+        self._db = db
+        self._table = table
+        self._op = "select"
+        self._columns = "*"
+        self._count = None
+        self._where = []
+        self._params = []
+        self._order = []
+        self._limit = None
+        self._offset = None
+        self._payload = None
+        self._ignore_duplicates = False
+
+    # --- builders ---
+    def select(self, columns: str = "*", count=None):
+        self._op, self._columns, self._count = "select", columns, count
+        return self
+
+    def insert(self, json_data):
+        self._op, self._payload = "insert", json_data if isinstance(json_data, list) else [json_data]
+        return self
+
+    def upsert(self, json_data, on_conflict: str = "", ignore_duplicates: bool = False, **kwargs):
+        self.insert(json_data)
+        self._op, self._ignore_duplicates = "upsert", ignore_duplicates
+        return self
+
+    def update(self, json_data):
+        self._op, self._payload = "update", json_data
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    def _filter(self, column, op, value):
+        self._where.append(f"{_ident(column)} {OPERATORS[op]} ?")
+        self._params.append(_encode(value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self._where.append("0")
+            return self
+        self._where.append(f"{_ident(column)} IN ({', '.join('?' * len(values))})")
+        self._params.extend(values)
+        return self
+
+    def or_(self, filters: str, reference_table=None):
+        self._where.append(_logic_sql(filters, " OR ", self._params))
+        return self
+
+    def order(self, column, desc: bool = False, **kwargs):
+        self._order.append(f"{_ident(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, size: int, **kwargs):
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int, **kwargs):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    # --- execution ---
+    def _where_sql(self):
+        return (" WHERE " + " AND ".join(self._where)) if self._where else ""
+
+    def execute(self):
+        if DB_LATENCY:
+            time.sleep(DB_LATENCY)
+        return self.run()
+
+    def run(self):
+        """Execute without the injected latency."""
+        db, table = self._db, self._table
+        with db._lock:
+            if self._op in ("insert", "upsert"):
+                return self._execute_insert()
+            if not db.columns(table):
+                return SimpleNamespace(data=[], count=0 if self._count else None)
+            if self._op == "update":
+                sets = ", ".join(f"{_ident(k)} = ?" for k in self._payload)
+                db.ensure_columns(table, [self._payload])
+                cur = db._conn.execute(f"UPDATE {_ident(table)} SET {sets}{self._where_sql()}",
+                                       [_encode(v) for v in self._payload.values()] + self._params)
+                db._conn.commit()
+                return SimpleNamespace(data=[{}] * cur.rowcount, count=None)
+            if self._op == "delete":
+                db._conn.execute(f"DELETE FROM {_ident(table)}{self._where_sql()}", self._params)
+                db._conn.commit()
+                return SimpleNamespace(data=[], count=None)
+
+            cols = "*" if self._columns.strip() == "*" else ", ".join(
+                _ident(c.strip()) for c in self._columns.split(",") if c.strip() in db.columns(table))
+            sql = f"SELECT {cols or '*'} FROM {_ident(table)}{self._where_sql()}"
+            if self._order:
+                sql += " ORDER BY " + ", ".join(self._order)
+            if self._limit is not None:
+                sql += f" LIMIT {int(self._limit)}"
+                if self._offset:
+                    sql += f" OFFSET {int(self._offset)}"
+            rows = [db.decode(table, r) for r in db._conn.execute(sql, self._params)]
+            count = None
+            if self._count:
+                count = db._conn.execute(f"SELECT COUNT(*) FROM {_ident(table)}{self._where_sql()}",
+                                         self._params).fetchone()[0]
+            return SimpleNamespace(data=rows, count=count)
+
+    def _execute_insert(self):
+        db, table = self._db, self._table
+        if not self._payload:
+            return SimpleNamespace(data=[], count=None)
+        db.ensure_columns(table, self._payload)
+        verb = "INSERT OR IGNORE" if self._ignore_duplicates else (
+            "INSERT OR REPLACE" if self._op == "upsert" else "INSERT")
+        inserted = []
+        for record in self._payload:
+            keys = list(record)
+            cur = db._conn.execute(
+                f"{verb} INTO {_ident(table)} ({', '.join(_ident(k) for k in keys)}) "
+                f"VALUES ({', '.join('?' * len(keys))})",
+                [_encode(record[k]) for k in keys],
+            )
+            if cur.rowcount:
+                inserted.append(record)
+        db._conn.commit()
+        return SimpleNamespace(data=inserted, count=None)
+
+
+class LocalBucket:
+    def __init__(self, root: str, bucket: str, latency: float = STORAGE_LATENCY):
+        self.id = bucket
+        self.root = os.path.join(root, bucket)
+        self.latency = latency
+
+    def _path(self, path: str) -> str:
+        full = os.path.normpath(os.path.join(self.root, path))
+        if not full.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"invalid object path: {path}")
+        return full
+
+    def _pause(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upload(self, path, file, file_options=None):
+        self._pause()
+        full = self._path(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        if isinstance(file, (bytes, bytearray)):
+            data = bytes(file)
+        elif hasattr(file, "read"):
+            data = file.read()
+        else:
+            with open(file, "rb") as f:
+                data = f.read()
+        with open(full, "wb") as f:
+            f.write(data)
+        return SimpleNamespace(path=path)
+
+    def upload_stream(self, path, chunks, content_type=None):
+        """Chunked upload, mirroring the raw REST upload used for streams."""
+        self._pause()
+        full = self._path(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+    def download(self, path, options=None) -> bytes:
+        self._pause()
+        with open(self._path(path), "rb") as f:
+            return f.read()
+
+    def create_signed_url(self, path, expires_in, options=None):
+        self._pause()
+        return {"signedURL": f"local://{self.id}/{path}?expires_in={expires_in}"}
+
+    def create_signed_urls(self, paths, expires_in, options=None):
+        self._pause()
+        return [{"path": p, "signedURL": f"local://{self.id}/{p}?expires_in={expires_in}", "error": None}
+                for p in paths]
+
+    def remove(self, paths):
+        self._pause()
+        for p in paths:
+            try:
+                os.unlink(self._path(p))
+            except FileNotFoundError:
+                pass
+        return [{"name": p} for p in paths]
+
+    def list(self, path=None, options=None):
+        self._pause()
+        base = self._path(path) if path else self.root
+        search = (options or {}).get("search", "")
+        try:
+            names = sorted(os.listdir(base))
+        except FileNotFoundError:
+            return []
+        return [{"name": n} for n in names if search in n]
+
+    def move(self, from_path, to_path):
+        self._pause()
+        dest = self._path(to_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(self._path(from_path), dest)
+        return {"message": "Successfully moved"}
+
+
+class LocalStorage:
+    def __init__(self, root: str = LOCAL_STORAGE_DIR):
+        self.root = root
+
+    def from_(self, bucket: str) -> LocalBucket:
+        return LocalBucket(self.root, bucket)
+
+
+class LocalClient:
+    """Duck-typed replacement for supabase.Client (table() and storage)."""
+
+    def __init__(self, db_path: str = LOCAL_DB_PATH, storage_dir: str = LOCAL_STORAGE_DIR):
+        self.db = LocalDatabase(db_path)
+        self.storage = LocalStorage(storage_dir)
+
+    def table(self, name: str) -> LocalQuery:
+        return LocalQuery(self.db, name)
+
+
+class AsyncLocalQuery:
+    """Wraps LocalQuery so execute() is awaitable, like postgrest's async builders."""
+
+    def __init__(self, query: LocalQuery):
+        self._query = query
+
+    def __getattr__(self, name):
+        builder = getattr(self._query, name)
+
+        def call(*args, **kwargs):
+            builder(*args, **kwargs)
+            return self
+        return call
+
+    async def execute(self):
+        if DB_LATENCY:
+            await asyncio.sleep(DB_LATENCY)
+        return self._query.run()
+
+
+class AsyncLocalBucket:
+    """Every LocalBucket method as a coroutine, like storage3's async bucket API."""
+
+    def __init__(self, bucket: LocalBucket):
+        self._bucket = bucket
+
+    def __getattr__(self, name):
+        method = getattr(self._bucket, name)
+
+        async def call(*args, **kwargs):
+            if STORAGE_LATENCY:
+                await asyncio.sleep(STORAGE_LATENCY)
+            return method(*args, **kwargs)
+        return call
+
+
+class AsyncLocalStorage:
+    def __init__(self, root: str):
+        self.root = root
+
+    def from_(self, bucket: str) -> AsyncLocalBucket:
+        return AsyncLocalBucket(LocalBucket(self.root, bucket, latency=0))
+
+
+class AsyncLocalClient:
+    """Duck-typed replacement for supabase.AsyncClient over the same data as a LocalClient."""
+
+    def __init__(self, client: LocalClient):
+        self.db = client.db
+        self.storage = AsyncLocalStorage(client.storage.root)
+
+    def table(self, name: str) -> AsyncLocalQuery:
+        return AsyncLocalQuery(LocalQuery(self.db, name))
@@ -0,0 +1,172 @@
+# services/metrics.py
+"""
+Request instrumentation.
+
+span("phase") times a block of work. The duration is recorded in a Prometheus
+histogram labelled with the current endpoint and, inside a request, added to
+that response's Server-Timing header. With gunicorn, set
+PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py does) so /api/metrics aggregates
+all workers. Async handlers in asgi.py use the timed() decorator instead of the
+Flask hooks.
+
+Opt-in profiling: PROFILE_SAMPLE_RATE (0..1) of requests run under cProfile;
+those slower than PROFILE_SLOW_MS are dumped to PROFILE_DIR and the top
+functions are logged.
+"""
+import os
+import time
+import random
+import logging
+import cProfile
+import pstats
+import io
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, request, has_request_context
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 1000))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = tuple(2 ** i for i in range(10, 27, 2))  # 1 KiB .. 64 MiB
+
+REQUEST_SECONDS = Histogram(
+    "echomind_request_seconds", "Request latency", ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS)
+PHASE_SECONDS = Histogram(
+    "echomind_phase_seconds", "Time spent in one phase of a request or job", ["endpoint", "phase"],
+    buckets=LATENCY_BUCKETS)
+PAYLOAD_BYTES = Histogram(
+    "echomind_payload_bytes", "Payload sizes", ["endpoint", "kind"], buckets=SIZE_BUCKETS)
+ERRORS = Counter("echomind_errors_total", "Handled server errors", ["endpoint"])
+# services/admission.py
+AUDIO_INFLIGHT_BYTES = Gauge(
+    "echomind_audio_inflight_bytes", "Audio bytes reserved by requests in progress", multiprocess_mode="livesum")
+ADMISSION_REJECTIONS = Counter(
+    "echomind_admission_rejections_total", "Submissions turned away by admission control", ["endpoint", "reason"])
+# services/stats_stream.py
+STATS_STREAM_SUBSCRIBERS = Gauge(
+    "echomind_stats_stream_subscribers", "Open /api/stats/stream connections", multiprocess_mode="livesum")
+
+# (endpoint, spans) of the async request being handled, set by timed()
+_async_request = ContextVar("async_request", default=None)
+
+
+def _endpoint() -> str:
+    current = _async_request.get()
+    if current is not None:
+        return current[0]
+    if has_request_context():
+        return request.endpoint or "unknown"
+    return "background"
+
+
+@contextmanager
+def span(phase: str):
+    """Time a block as one phase of the current request (or background job)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_SECONDS.labels(_endpoint(), phase).observe(elapsed)
+        current = _async_request.get()
+        if current is not None:
+            current[1].append((phase, elapsed))
+        elif has_request_context():
+            g.setdefault("spans", []).append((phase, elapsed))
+
+
+def observe_size(kind: str, size):
+    if size:
+        PAYLOAD_BYTES.labels(_endpoint(), kind).observe(size)
+
+
+def record_error():
+    ERRORS.labels(_endpoint()).inc()
+
+
+def metrics_response():
+    """(body, content_type) for the Prometheus scrape endpoint."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+    observe_size("request_body", request.content_length)
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _after_request(response):
+    start = g.pop("request_start", None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    REQUEST_SECONDS.labels(_endpoint(), request.method, str(response.status_code)).observe(elapsed)
+
+    response.headers["Server-Timing"] = _server_timing(g.get("spans", []), elapsed)
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        if elapsed * 1000 >= PROFILE_SLOW_MS:
+            _dump_profile(profiler, elapsed)
+    return response
+
+
+def _server_timing(spans, elapsed) -> str:
+    timings = [f"{phase};dur={secs * 1000:.1f}" for phase, secs in spans]
+    timings.append(f"total;dur={elapsed * 1000:.1f}")
+    return ", ".join(timings)
+
+
+def _dump_profile(profiler, elapsed):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{_endpoint()}-{int(time.time() * 1000)}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+        logger.warning("slow request %s %.0f ms, profile saved to %s\n%s",
+                       request.path, elapsed * 1000, path, out.getvalue())
+    except Exception:
+        logger.exception("could not write profile")
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+
+def timed(endpoint: str):
+    """Request metrics and Server-Timing for an async (Starlette) handler."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            start = time.perf_counter()
+            token = _async_request.set((endpoint, []))
+            try:
+                size = request.headers.get("content-length")
+                observe_size("request_body", int(size) if size and size.isdigit() else None)
+                response = await handler(request)
+                elapsed = time.perf_counter() - start
+                REQUEST_SECONDS.labels(endpoint, request.method, str(response.status_code)).observe(elapsed)
+                response.headers["Server-Timing"] = _server_timing(_async_request.get()[1], elapsed)
+                return response
+            finally:
+                _async_request.reset(token)
+        return wrapper
+    return decorator
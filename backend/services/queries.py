@@ -0,0 +1,242 @@
+# services/queries.py
+import os
+import json
+import time
+import base64
+import threading
+from datetime import datetime, timedelta, timezone
+from services.supabase_client import get_supabase, get_async_supabase
+
+ASSESSMENTS_TABLE = os.getenv("ASSESSMENTS_TABLE", "voice_assessments")
+# created_at is stamped before the insert round-trip, so a row can become
+# visible after rows with later timestamps; catch-up scans reach back this far
+CATCHUP_LAG = float(os.getenv("CATCHUP_LAG_SECONDS", 120))
+
+
+def keyset_condition(created_at: str, row_id: str, desc: bool = False) -> str:
+    """
+    PostgREST `or` filter selecting rows strictly after (created_at, id)
+    in the given sort direction. Values are quoted because timestamps
+    contain characters that are reserved inside logic trees.
+    """
+    op = "lt" if desc else "gt"
+    return (
+        f'created_at.{op}."{created_at}",'
+        f'and(created_at.eq."{created_at}",id.{op}."{row_id}")'
+    )
+
+
+def parse_timestamp(value: str) -> float:
+    """
+    created_at as epoch seconds. Rows written by this app carry naive
+    utcnow() values while Supabase returns timestamptz with an offset, so
+    timestamps are compared parsed, never as strings.
+    """
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def catchup_since(watermark: str) -> str:
+    """Where a catch-up scan starts: CATCHUP_LAG before the watermark, in the watermark's own format."""
+    return (datetime.fromisoformat(watermark) - timedelta(seconds=CATCHUP_LAG)).isoformat()
+
+
+def iter_assessments(columns: str, since: str = None, page_size: int = 1000):
+    """
+    Yield pages (lists of dicts) of assessments in (created_at, id) ascending
+    order, optionally starting at rows with created_at >= since.
+    Uses keyset pagination so every page costs the same regardless of depth.
+    """
+    last = None
+    while True:
+        query = get_supabase().table(ASSESSMENTS_TABLE).select(columns)
+        if last is not None:
+            query = query.or_(keyset_condition(last["created_at"], last["id"]))
+        elif since is not None:
+            query = query.gte("created_at", since)
+        res = query.order("created_at").order("id").limit(page_size).execute()
+        rows = res.data or []
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1]
+
+
+class CatchupScan:
+    """
+    Forward scans over the assessments table for the in-memory aggregates
+    (StatsAggregate, AnalyticsSnapshot). Each scan starts CATCHUP_LAG before
+    the newest created_at seen so far, so rows whose insert landed late are
+    still found; ids inside that window are remembered so fresh() never
+    hands out a row twice.
+
+    The consumer passes every page, and every row it inserts itself,
+    through fresh() while holding the lock that guards its own state, so
+    checking and applying a row is atomic against concurrent scans.
+    """
+
+    def __init__(self, columns: str, page_size: int, interval: float):
+        self.columns = columns
+        self.page_size = page_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the watermark and every id seen; the next scan reads the whole table."""
+        with self._lock:
+            self._watermark = None
+            self._seen = {}
+            self._last_scan = 0.0
+            self.loaded = False
+
+    def fresh(self, rows: list, stored: bool = True) -> list:
+        """
+        The rows not returned before, now marked as seen. stored=False is for
+        rows this process just inserted: their created_at may be stamped
+        locally, so the database's value replaces it once a scan reads them.
+        """
+        fresh = []
+        with self._lock:
+            for row in rows:
+                rid = row.get("id")
+                created = parse_timestamp(row["created_at"]) if row.get("created_at") else time.time()
+                if rid in self._seen:
+                    if stored:
+                        # prune by the database's timestamp, not the one this process stamped
+                        self._seen[rid] = created
+                    continue
+                self._seen[rid] = created
+                fresh.append(row)
+        return fresh
+
+    def run(self, apply, force: bool = False):
+        """
+        Call apply(page) for each page created since the last scan and move
+        the watermark. A no-op within `interval` of the last scan unless
+        forced; once loaded, returns at once if another thread is scanning.
+        """
+        if not force and self.loaded and time.monotonic() - self._last_scan < self.interval:
+            return
+        if not self._scan_lock.acquire(blocking=not self.loaded):
+            # another thread is already catching up; serve current state
+            return
+        try:
+            with self._lock:
+                watermark = self._watermark
+            since = catchup_since(watermark) if watermark is not None else None
+            for page in iter_assessments(self.columns, since=since, page_size=self.page_size):
+                apply(page)
+                watermark = page[-1].get("created_at") or watermark
+            with self._lock:
+                self._watermark = watermark
+                if watermark is not None:
+                    # only ids inside the lag window can be returned again by the next scan
+                    cutoff = parse_timestamp(watermark) - CATCHUP_LAG
+                    self._seen = {k: v for k, v in self._seen.items() if v >= cutoff}
+                self._last_scan = time.monotonic()
+                self.loaded = True
+        finally:
+            self._scan_lock.release()
+
+    def rebuild(self, clear, apply):
+        """
+        Start over: run clear() while no scan is in progress, then scan the
+        whole table. clear() empties the consumer's state and calls reset()
+        under the consumer's lock, so no fresh() slips in between.
+        """
+        with self._scan_lock:
+            clear()
+        self.run(apply, force=True)
+
+
+ASSESSMENT_COLUMNS = [
+    "id", "full_name", "age", "gender", "current_medication", "recording_environment",
+    "language_dialect", "question1", "question2", "question3", "question4", "question5",
+    "question6", "question7", "question8", "phq8_total_score", "severity", "consent_data",
+    "audio_path", "audio_url", "has_audio", "status", "created_at", "updated_at",
+]
+
+
+def parse_fields(fields: str) -> str:
+    """
+    Turn a comma separated `fields=` value into a select() column list.
+    id and created_at are always included because the cursor is built from them,
+    and audio_url pulls in audio_path because URLs are signed from it.
+    Raises ValueError on unknown columns.
+    """
+    if not fields:
+        return "*"
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in ASSESSMENT_COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    if "audio_url" in requested and "audio_path" not in requested:
+        requested.append("audio_path")
+    columns = ["id", "created_at"] + [f for f in requested if f not in ("id", "created_at")]
+    return ",".join(columns)
+
+
+def parse_offset(value) -> int:
+    """Legacy `offset=` value; raises ValueError unless it is a non-negative integer."""
+    offset = int(value)
+    if offset < 0:
+        raise ValueError("offset must not be negative")
+    return offset
+
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Return (created_at, id) from an opaque cursor; raises ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(row_id, str):
+        raise ValueError("invalid cursor")
+    if any(c in value for value in (created_at, row_id) for c in '"\\'):
+        # values are embedded in a quoted PostgREST filter
+        raise ValueError("invalid cursor")
+    return created_at, row_id
+
+
+def _page_query(client, columns: str, limit: int, cursor: str, desc: bool):
+    query = client.table(ASSESSMENTS_TABLE).select(columns)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.or_(keyset_condition(created_at, row_id, desc=desc))
+    # fetch one extra row to know whether another page exists
+    return query.order("created_at", desc=desc).order("id", desc=desc).limit(limit + 1)
+
+
+def _page_result(rows: list, limit: int):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def fetch_assessment_page(columns: str, limit: int, cursor: str = None, desc: bool = True):
+    """
+    One page of assessments ordered by (created_at, id), newest first by default.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    res = _page_query(get_supabase(), columns, limit, cursor, desc).execute()
+    return _page_result(res.data or [], limit)
+
+
+async def afetch_assessment_page(columns: str, limit: int, cursor: str = None, desc: bool = True):
+    """fetch_assessment_page on the async client."""
+    client = await get_async_supabase()
+    res = await _page_query(client, columns, limit, cursor, desc).execute()
+    return _page_result(res.data or [], limit)
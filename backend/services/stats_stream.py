@@ -0,0 +1,248 @@
+# services/stats_stream.py
+"""
+Live dashboard statistics over Server-Sent Events (/api/stats/stream).
+
+A subscriber first gets the whole /api/stats payload as a "snapshot" event,
+then "delta" events carrying only the top-level fields that changed. Writers
+call stats_hub.notify() after stats_aggregate.record(); one publisher thread
+per process then re-reads the aggregate, diffs it against the last published
+state and encodes the event once for every subscriber. Bursts of submissions
+are coalesced: the publisher sleeps STATS_STREAM_INTERVAL_SECONDS after each
+event, so there is at most one event per interval. Rows written by other
+workers arrive through stats_aggregate.refresh(), which the publisher runs
+every STATS_CATCHUP_SECONDS while anyone is subscribed.
+
+Async subscribers (asgi.py) wait on one asyncio.Event per event loop, so an
+idle connection costs a suspended generator, not a thread. The Flask route
+holds a worker thread per connection, so it answers 503 unless
+STATS_STREAM_WSGI_MAX_SUBSCRIBERS is raised above 0 (only sensible with
+threaded workers); with the default sync gunicorn worker one open
+dashboard would block every other request. Clients then fall back to
+polling /api/stats.
+
+A subscriber that falls more than one event behind gets a fresh snapshot
+instead of the deltas it missed.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from services.aggregates import stats_aggregate, CATCHUP_INTERVAL
+from services.circuit import CircuitOpen
+from services.metrics import STATS_STREAM_SUBSCRIBERS
+
+INTERVAL = float(os.getenv("STATS_STREAM_INTERVAL_SECONDS", 1))
+KEEPALIVE_SECONDS = float(os.getenv("STATS_STREAM_KEEPALIVE_SECONDS", 15))
+WSGI_MAX_SUBSCRIBERS = int(os.getenv("STATS_STREAM_WSGI_MAX_SUBSCRIBERS", 0))
+RETRY_MS = int(os.getenv("STATS_STREAM_RETRY_MS", 5000))
+
+HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+PREAMBLE = f"retry: {RETRY_MS}\n\n".encode()
+KEEPALIVE = b": keepalive\n\n"
+
+logger = logging.getLogger(__name__)
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def _event(name: str, version: int, payload: dict) -> bytes:
+    return f"event: {name}\nid: {version}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+
+class StatsHub:
+    def __init__(self, interval: float = INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._publish_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._state = {}
+        self._version = 0
+        self._snapshot_event = None
+        self._delta_event = None
+        self._loop_events = {}
+        self._subscribers = 0
+        self._wsgi_subscribers = 0
+        self._pid = None
+
+    # ---- publishing ----
+
+    def notify(self):
+        """Something changed the aggregate; publish it with the next event."""
+        self._wake.set()
+
+    def _ensure_started(self):
+        # threads do not survive fork, so start the publisher per process on first use
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._loop_events = {}
+            threading.Thread(target=self._run, name="stats-stream", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=CATCHUP_INTERVAL)
+            self._wake.clear()
+            if not self._subscribers:
+                # nobody listening: the next subscriber publishes on connect
+                continue
+            try:
+                self.publish()
+            except CircuitOpen as e:
+                logger.warning("stats stream refresh skipped: %s", e)
+            except Exception:
+                logger.exception("stats stream publish failed")
+            # changes made while sleeping are folded into the next event
+            time.sleep(self.interval)
+
+    def publish(self):
+        """Catch up the aggregate and, if anything changed, publish one event."""
+        with self._publish_lock:
+            stats_aggregate.refresh()
+            state = stats_aggregate.to_response()
+            delta = {k: v for k, v in state.items() if self._state.get(k) != v}
+            if not delta:
+                return
+            version = self._version + 1
+            snapshot_event = _event("snapshot", version, state)
+            delta_event = _event("delta", version, delta)
+            with self._lock:
+                self._state, self._version = state, version
+                self._snapshot_event, self._delta_event = snapshot_event, delta_event
+                self._changed.notify_all()
+                loops = list(self._loop_events)
+            for loop in loops:
+                try:
+                    loop.call_soon_threadsafe(self._wake_loop, loop)
+                except RuntimeError:  # loop closed
+                    with self._lock:
+                        self._loop_events.pop(loop, None)
+
+    def _wake_loop(self, loop):
+        # runs on loop: waiters hold the old event, later waiters get a new one
+        with self._lock:
+            event = self._loop_events.pop(loop, None)
+        if event is not None:
+            event.set()
+
+    def _loop_event(self, loop) -> asyncio.Event:
+        with self._lock:
+            event = self._loop_events.get(loop)
+            if event is None:
+                event = self._loop_events[loop] = asyncio.Event()
+            return event
+
+    def _next(self, seen):
+        """(version, event bytes or None) for a subscriber that has seen version `seen` (None: nothing yet)."""
+        with self._lock:
+            if self._version == seen:
+                return seen, None
+            if seen is not None and self._version == seen + 1:
+                return self._version, self._delta_event
+            return self._version, self._snapshot_event
+
+    # ---- subscribing ----
+
+    def _subscribe(self) -> bool:
+        """Count a subscriber; True if it is the only one (the state may be stale)."""
+        self._ensure_started()
+        with self._lock:
+            self._subscribers += 1
+            first = self._subscribers == 1
+        STATS_STREAM_SUBSCRIBERS.inc()
+        return first
+
+    def _unsubscribe(self):
+        with self._lock:
+            self._subscribers -= 1
+        STATS_STREAM_SUBSCRIBERS.dec()
+
+    def open(self):
+        """
+        Register a subscriber and make sure there is a current snapshot to send.
+        Blocking (it may refresh the aggregate); pair with close().
+        """
+        first = self._subscribe()
+        try:
+            if first or not self._version:
+                self.publish()
+        except BaseException:
+            self._unsubscribe()
+            raise
+
+    def close(self):
+        self._unsubscribe()
+
+    async def events(self):
+        """Async SSE byte stream for a subscriber registered with open(); closes it when done."""
+        loop = asyncio.get_running_loop()
+        seen = None
+        try:
+            yield PREAMBLE
+            while True:
+                # take the event before checking, so a publish in between still wakes us
+                changed = self._loop_event(loop)
+                seen, event = self._next(seen)
+                if event is not None:
+                    yield event
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+        finally:
+            self.close()
+
+    def wsgi_events(self):
+        """
+        Blocking SSE byte stream for the Flask route, as (stream, release).
+        release() gives the slot back and must run when the response closes
+        (Response.call_on_close), also when the stream was never iterated,
+        e.g. for HEAD. Raises TooManySubscribers when this process already
+        holds its share of threads.
+        """
+        with self._lock:
+            if self._wsgi_subscribers >= WSGI_MAX_SUBSCRIBERS:
+                raise TooManySubscribers()
+            self._wsgi_subscribers += 1
+        try:
+            self.open()
+        except BaseException:
+            with self._lock:
+                self._wsgi_subscribers -= 1
+            raise
+
+        released = []
+
+        def release():
+            with self._lock:
+                if released:
+                    return
+                released.append(True)
+                self._wsgi_subscribers -= 1
+            self.close()
+
+        return self._wsgi_stream(), release
+
+    def _wsgi_stream(self):
+        seen = None
+        yield PREAMBLE
+        while True:
+            seen, event = self._next(seen)
+            if event is not None:
+                yield event
+                continue
+            with self._changed:
+                if not self._changed.wait_for(lambda: self._version != seen, timeout=KEEPALIVE_SECONDS):
+                    event = KEEPALIVE
+            if event is not None:
+                yield event
+
+stats_hub = StatsHub()
@@ -1,61 +1,337 @@
 import os
-import tempfile
+import time
 import base64
-from services.supabase_client import supabase
-from typing import Tuple
+import asyncio
+import hashlib
+import logging
+import threading
+from services.supabase_client import get_supabase, get_async_supabase, get_http, SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY
+from services.circuit import CircuitOpen
+from services.metrics import span, observe_size
+from typing import BinaryIO
 
 BUCKET = os.getenv("SUPABASE_BUCKET", "voice_recordings")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 64 * 1024))
+SIGNED_URL_TTL = int(os.getenv("SIGNED_URL_TTL_SECONDS", 3600))
+SIGNED_URL_REFRESH_MARGIN = int(os.getenv("SIGNED_URL_REFRESH_MARGIN_SECONDS", 300))
+SIGNED_URL_CACHE_MAX = int(os.getenv("SIGNED_URL_CACHE_MAX", 10000))
+AUDIO_INDEX_CACHE_MAX = int(os.getenv("AUDIO_INDEX_CACHE_MAX", 100000))
+CONTENT_PREFIX = "recordings/sha256"
 
+logger = logging.getLogger(__name__)
 
-def upload_audio_base64(assessment_id: str, audio_base64: str, content_type: str = "audio/webm") -> Tuple[str, str]:
+AUDIO_EXTENSIONS = {
+    "audio/webm": "webm",
+    "audio/ogg": "ogg",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/mpeg": "mp3",
+    "audio/mp4": "m4a",
+}
+
+# storage_path -> (signed_url, monotonic time after which it must be re-signed)
+_signed_cache = {}
+_signed_lock = threading.Lock()
+
+# content-addressed paths known to exist; objects under CONTENT_PREFIX never change
+_known_audio = set()
+_known_lock = threading.Lock()
+
+
+def audio_extension(content_type: str) -> str:
+    base = (content_type or "").split(";", 1)[0].strip().lower()
+    return AUDIO_EXTENSIONS.get(base, "webm")
+
+
+def _cached_signed_urls(paths, now: float):
+    """Split paths into ({path: url} still fresh in the cache, [paths to sign])."""
+    result, missing = {}, []
+    with _signed_lock:
+        for path in dict.fromkeys(p for p in paths if p):
+            hit = _signed_cache.get(path)
+            if hit and hit[1] > now:
+                result[path] = hit[0]
+            else:
+                missing.append(path)
+    return result, missing
+
+
+def _remember_signed_urls(signed, now: float, result: dict) -> dict:
+    fresh_until = now + SIGNED_URL_TTL - SIGNED_URL_REFRESH_MARGIN
+    with _signed_lock:
+        if len(_signed_cache) > SIGNED_URL_CACHE_MAX:
+            for key in [k for k, v in _signed_cache.items() if v[1] <= now]:
+                del _signed_cache[key]
+        for item in signed or []:
+            path = item.get("path")
+            url = item.get("signedURL") or item.get("signedUrl")
+            if path and url and not item.get("error"):
+                result[path] = url
+                _signed_cache[path] = (url, fresh_until)
+    return result
+
+
+def sign_audio_paths(paths) -> dict:
     """
-    Upload a base64 audio string to Supabase Storage.
-    Returns (storage_path, signed_url)
+    Return {storage_path: signed_url} for the given paths. URLs are cached in
+    memory until SIGNED_URL_REFRESH_MARGIN seconds before they expire; all
+    paths missing from the cache are signed in a single batched request.
+
+    Never raises: storage3 fails the whole batch when one object is missing
+    (not uploaded yet, or audio_pending), so the batch is retried path by
+    path and anything that still cannot be signed is left out (audio_url
+    None) rather than failing the read.
     """
-    if not audio_base64:
-        return None, None
+    now = time.monotonic()
+    result, missing = _cached_signed_urls(paths, now)
+    if not missing:
+        return result
+    bucket = get_supabase().storage.from_(BUCKET)
+    with span("sign_urls"):
+        try:
+            return _remember_signed_urls(bucket.create_signed_urls(missing, SIGNED_URL_TTL), now, result)
+        except CircuitOpen:
+            return result
+        except Exception as e:
+            logger.warning("batch URL signing failed for %d paths, signing one by one: %s", len(missing), e)
+        for path in missing:
+            try:
+                _remember_signed_urls(bucket.create_signed_urls([path], SIGNED_URL_TTL), now, result)
+            except CircuitOpen:
+                break
+            except Exception as e:
+                logger.warning("could not sign %s: %s", path, e)
+    return result
+
+
+async def asign_audio_paths(paths) -> dict:
+    """sign_audio_paths on the async client; shares the same URL cache and never raises either."""
+    now = time.monotonic()
+    result, missing = _cached_signed_urls(paths, now)
+    if not missing:
+        return result
+    client = await get_async_supabase()
+    bucket = client.storage.from_(BUCKET)
+    with span("sign_urls"):
+        try:
+            return _remember_signed_urls(await bucket.create_signed_urls(missing, SIGNED_URL_TTL), now, result)
+        except CircuitOpen:
+            return result
+        except Exception as e:
+            logger.warning("batch URL signing failed for %d paths, signing one by one: %s", len(missing), e)
+        signed = await asyncio.gather(*(bucket.create_signed_urls([path], SIGNED_URL_TTL) for path in missing),
+                                      return_exceptions=True)
+        for path, outcome in zip(missing, signed):
+            if isinstance(outcome, BaseException):
+                if not isinstance(outcome, CircuitOpen):
+                    logger.warning("could not sign %s: %s", path, outcome)
+                continue
+            _remember_signed_urls(outcome, now, result)
+    return result
+
+
+def _fill_audio_urls(rows: list, urls: dict) -> list:
+    for r in rows:
+        if r.get("audio_path"):
+            r["audio_url"] = urls.get(r["audio_path"])
+    return rows
 
-    # Remove MIME prefix if present
+
+def attach_audio_urls(rows: list) -> list:
+    """Fill audio_url on each row that has an audio_path, in place."""
+    paths = [r.get("audio_path") for r in rows if r.get("audio_path")]
+    return _fill_audio_urls(rows, sign_audio_paths(paths) if paths else {})
+
+
+async def aattach_audio_urls(rows: list) -> list:
+    paths = [r.get("audio_path") for r in rows if r.get("audio_path")]
+    return _fill_audio_urls(rows, await asign_audio_paths(paths) if paths else {})
+
+
+def audio_storage_path(assessment_id: str, content_type: str = "audio/webm") -> str:
+    """Per-assessment path, used for streamed uploads whose hash is not known up front."""
+    return f"recordings/{assessment_id}.{audio_extension(content_type)}"
+
+
+def content_storage_path(sha256: str) -> str:
+    """
+    Content-addressed path: identical recordings share one object. The key is
+    the hash alone (the content type is kept as object metadata), so a lookup
+    by hash finds the recording whatever format the browser recorded in.
+    """
+    return f"{CONTENT_PREFIX}/{sha256}"
+
+
+def decode_audio_base64(audio_base64: str) -> bytes:
+    """Bytes of a base64 (optionally data:-prefixed) recording; raises ValueError if malformed."""
     if audio_base64.startswith("data:"):
         audio_base64 = audio_base64.split(",", 1)[1]
-
     try:
-        audio_bytes = base64.b64decode(audio_base64)
+        with span("b64decode"):
+            audio_bytes = base64.b64decode(audio_base64)
     except Exception:
         raise ValueError("Invalid Base64 audio string")
+    observe_size("audio", len(audio_bytes))
+    return audio_bytes
 
-    filename = f"{assessment_id}.webm"
-    storage_path = f"recordings/{filename}"
 
-    # Save audio temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp:
-        tmp.write(audio_bytes)
-        tmp.flush()
-        tmp_path = tmp.name
+def audio_digest(audio_bytes: bytes, expected: str = None) -> str:
+    """Hex SHA-256 of a recording; raises ValueError if it differs from the client's audioSha256."""
+    with span("sha256"):
+        digest = hashlib.sha256(audio_bytes).hexdigest()
+    if expected and digest != expected:
+        raise ValueError("audio does not match audioSha256")
+    return digest
 
-    # Upload correctly
-    upload_res = supabase.storage.from_(BUCKET).upload(
-        storage_path,
-        tmp_path,
-        file_options={"content-type": content_type},
-        upsert=True
-    )
 
-    # Remove temp file
-    try:
-        os.unlink(tmp_path)
-    except:
-        pass
-
-    # Create signed URL (24h)
-    signed = supabase.storage.from_(BUCKET).create_signed_url(
-        storage_path,
-        24 * 3600
-    )
-
-    # Extract signed URL safely
-    signed_url = None
-    if isinstance(signed, dict):
-        signed_url = signed.get("signedURL") or signed.get("url") or signed.get("signed_url")
-
-    return storage_path, signed_url
+def _remember_audio(storage_path: str):
+    with _known_lock:
+        if len(_known_audio) >= AUDIO_INDEX_CACHE_MAX:
+            _known_audio.clear()
+        _known_audio.add(storage_path)
+
+
+def _listed(items, name: str) -> bool:
+    return any(item.get("name") == name for item in items or [])
+
+
+def audio_exists(storage_path: str) -> bool:
+    """
+    Whether a content-addressed recording is already stored. Checks the
+    in-process index first, then lists the object in the bucket.
+    """
+    if storage_path in _known_audio:
+        return True
+    folder, name = storage_path.rsplit("/", 1)
+    with span("audio_lookup"):
+        items = get_supabase().storage.from_(BUCKET).list(folder, {"search": name})
+    if not _listed(items, name):
+        return False
+    _remember_audio(storage_path)
+    return True
+
+
+async def aaudio_exists(storage_path: str) -> bool:
+    if storage_path in _known_audio:
+        return True
+    folder, name = storage_path.rsplit("/", 1)
+    client = await get_async_supabase()
+    with span("audio_lookup"):
+        items = await client.storage.from_(BUCKET).list(folder, {"search": name})
+    if not _listed(items, name):
+        return False
+    _remember_audio(storage_path)
+    return True
+
+
+def stored_audio_path(sha256: str):
+    """Storage path of an already uploaded recording with this hash, or None."""
+    storage_path = content_storage_path(sha256)
+    return storage_path if audio_exists(storage_path) else None
+
+
+def upload_audio_base64(audio_base64: str, content_type: str = "audio/webm", expected_sha256: str = None) -> str:
+    """
+    Upload a base64 audio string to Supabase Storage under its content hash,
+    skipping the upload when the same recording is already stored.
+    Returns the storage_path; URLs are signed at read time (sign_audio_paths).
+    """
+    if not audio_base64:
+        return None
+
+    audio_bytes = decode_audio_base64(audio_base64)
+    storage_path = content_storage_path(audio_digest(audio_bytes, expected_sha256))
+    if audio_exists(storage_path):
+        return storage_path
+
+    # Upload the decoded bytes directly, no temp file needed
+    with span("storage_upload"):
+        get_supabase().storage.from_(BUCKET).upload(
+            storage_path,
+            audio_bytes,
+            file_options={"content-type": content_type, "upsert": "true"}
+        )
+    _remember_audio(storage_path)
+
+    return storage_path
+
+
+def _stream_to(storage_path: str, stream: BinaryIO, content_type: str) -> bool:
+    """
+    Stream raw audio bytes from a file-like object to Supabase Storage in
+    UPLOAD_CHUNK_SIZE pieces (chunked transfer), without buffering the whole
+    recording or writing a temp file. Returns False if the stream was empty.
+    """
+    first = stream.read(UPLOAD_CHUNK_SIZE)
+    if not first:
+        return False
+
+    def chunks():
+        yield first
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    bucket = get_supabase().storage.from_(BUCKET)
+    with span("storage_upload"):
+        if hasattr(bucket, "upload_stream"):
+            # local backend (DATA_BACKEND=local)
+            bucket.upload_stream(storage_path, chunks(), content_type)
+            return True
+
+        res = get_http().post(
+            f"{SUPABASE_URL}/storage/v1/object/{BUCKET}/{storage_path}",
+            content=chunks(),
+            headers={
+                "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+                "apikey": SUPABASE_SERVICE_ROLE_KEY,
+                "content-type": content_type,
+                "x-upsert": "true",
+            },
+        )
+        res.raise_for_status()
+    return True
+
+
+def upload_audio_stream(assessment_id: str, stream: BinaryIO, content_type: str = "audio/webm") -> str:
+    """
+    Stream a request body to storage under the assessment's own path (the hash
+    is only known once every byte has gone by). Returns the storage_path.
+    """
+    storage_path = audio_storage_path(assessment_id, content_type)
+    return storage_path if _stream_to(storage_path, stream, content_type) else None
+
+
+def upload_audio_file(file_path: str, content_type: str = "audio/webm") -> str:
+    """Upload a local file (the upload queue's spool) under its content hash, unless already stored."""
+    digest = hashlib.sha256()
+    with span("sha256"), open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    storage_path = content_storage_path(digest.hexdigest())
+    if audio_exists(storage_path):
+        return storage_path
+    with open(file_path, "rb") as f:
+        if not _stream_to(storage_path, f, content_type):
+            return None
+    _remember_audio(storage_path)
+    return storage_path
+
+
+async def aupload_audio_bytes(audio_bytes: bytes, content_type: str = "audio/webm", sha256: str = None) -> str:
+    """upload_audio_base64 for decoded bytes on the async client. Returns the storage_path."""
+    storage_path = content_storage_path(sha256 or audio_digest(audio_bytes))
+    if await aaudio_exists(storage_path):
+        return storage_path
+    client = await get_async_supabase()
+    with span("storage_upload"):
+        await client.storage.from_(BUCKET).upload(
+            storage_path,
+            audio_bytes,
+            file_options={"content-type": content_type, "upsert": "true"}
+        )
+    _remember_audio(storage_path)
+    return storage_path
@@ -0,0 +1,110 @@
+# services/submissions.py
+import re
+import uuid
+from datetime import datetime
+from services.utils import calculate_phq8_score_and_severity
+
+REQUIRED_FIELDS = ["age", "gender", "currentMedication", "recordingEnvironment", "languageDialect",
+                   "question1", "question2", "question3", "question4", "question5", "question6",
+                   "question7", "question8"]
+
+CONSENT_REQUIRED_FIELDS = [
+    "voluntary", "optOut", "ageConfirm", "aiRole", "purpose",
+    "nonDiagnostic", "dataType", "anonymization", "futureResearch", "thirdParty"
+]
+
+# fixed namespace so a client-supplied id always maps to the same assessment id
+CLIENT_ID_NAMESPACE = uuid.UUID("6f1d8a52-3c1e-4e0b-9a57-2f4c8e1b7d90")
+
+MAX_AGE = 120
+# PHQ-8 items are scored 0 (not at all) .. 3 (nearly every day)
+ANSWER_RANGE = range(0, 4)
+
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+def assessment_id_for(client_id: str) -> str:
+    """Deterministic assessment id for a client-supplied id, used for idempotent retries."""
+    return str(uuid.uuid5(CLIENT_ID_NAMESPACE, str(client_id)))
+
+
+def validate_submission(data: dict, require_audio_data: bool = True):
+    """
+    Validate a submission payload (camelCase keys, as sent by the frontend).
+    Returns (error_code, None) on failure or (None, cleaned) on success,
+    where cleaned holds the parsed age, consent and PHQ-8 score/severity.
+    """
+    if not data:
+        return "invalid_json", None
+
+    # Accept consent key in either name
+    consent = data.get("consent") or data.get("consentData") or {}
+
+    # audioSha256 of an already uploaded recording, or the audioUploadId of a
+    # finalized upload session, can stand in for audioData
+    audio_sha256 = data.get("audioSha256")
+    if audio_sha256 is not None and not (isinstance(audio_sha256, str) and SHA256_HEX.match(audio_sha256)):
+        return "invalid_audioSha256", None
+    audio_ref = audio_sha256 or data.get("audioUploadId")
+
+    required = REQUIRED_FIELDS + (["audioData"] if require_audio_data and not audio_ref else [])
+    for field in required:
+        if field not in data:
+            return f"missing_{field}", None
+
+    # age validation
+    try:
+        age = int(data.get("age"))
+    except (TypeError, ValueError):
+        return "age_must_be_integer", None
+    if age < 18:
+        return "age_must_be_18_or_over", None
+    if age > MAX_AGE:
+        return "age_out_of_range", None
+
+    # enforce consent fields are true
+    for cf in CONSENT_REQUIRED_FIELDS:
+        if not consent.get(cf, False):
+            return f"consent_required_{cf}", None
+
+    answers = {}
+    for i in range(1, 9):
+        try:
+            answers[f"question{i}"] = int(data.get(f"question{i}"))
+        except (TypeError, ValueError):
+            return f"question{i}_must_be_integer", None
+        if answers[f"question{i}"] not in ANSWER_RANGE:
+            return f"question{i}_out_of_range", None
+
+    score, severity = calculate_phq8_score_and_severity(answers)
+    return None, {"age": age, "consent": consent, "answers": answers, "score": score, "severity": severity}
+
+
+def build_record(aid: str, data: dict, cleaned: dict, storage_path=None, status: str = "submitted") -> dict:
+    """
+    Map a validated submission onto a voice_assessments row. audio_url is left
+    empty: signed URLs are generated at read time from audio_path.
+    """
+    now = datetime.utcnow().isoformat()
+    record = {
+        "id": aid,
+        "full_name": data.get("fullName") or None,
+        "age": cleaned["age"],
+        "gender": data.get("gender"),
+        "current_medication": data.get("currentMedication"),
+        "recording_environment": data.get("recordingEnvironment"),
+        "language_dialect": data.get("languageDialect"),
+    }
+    record.update(cleaned["answers"])
+    record.update({
+        "phq8_total_score": cleaned["score"],
+        "severity": cleaned["severity"],
+        "consent_data": cleaned["consent"],
+        "audio_path": storage_path,
+        "audio_url": None,
+        "has_audio": bool(storage_path),
+        "status": status,
+        "created_at": now,
+        "updated_at": now
+    })
+    return record
@@ -1,15 +1,126 @@
 # services/supabase_client.py
-from supabase import create_client
+"""
+Supabase clients for this process.
+
+Nothing connects at import time: get_supabase() and get_async_supabase()
+build the client on first use in each process, so gunicorn workers never
+inherit the master's connections (gunicorn.conf.py warms them up at worker
+boot). The HTTP pools keep connections alive between requests and every call
+goes through the circuit breaker in services/circuit.py.
+"""
 import os
+import threading
+import httpx
 from dotenv import load_dotenv
+from services.circuit import BreakerTransport, AsyncBreakerTransport
 
+# the only place .env is read; imported before anything else reads settings
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# "supabase" (default) or "local" for the in-process SQLite/filesystem stand-in
+DATA_BACKEND = os.getenv("DATA_BACKEND", "supabase")
+
+HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("SUPABASE_POOL_MAX_CONNECTIONS", 50)),
+    max_keepalive_connections=int(os.getenv("SUPABASE_POOL_KEEPALIVE", 20)),
+    # longer than httpx's 5s default so connections survive gaps between requests
+    keepalive_expiry=float(os.getenv("SUPABASE_POOL_KEEPALIVE_SECONDS", 60)),
+)
+
+
+class PerProcess:
+    """A lazily built value that a forked child rebuilds instead of inheriting."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._value = self._factory()
+                    self._pid = pid
+        return self._value
+
+
+def pooled_http_client(**kwargs) -> httpx.Client:
+    """httpx client on the tuned pool, behind the circuit breaker."""
+    return httpx.Client(transport=BreakerTransport(http2=True, limits=HTTP_LIMITS), **kwargs)
+
+
+def _pooled_session(session, transport):
+    # same settings supabase-py uses for its own sessions, on our transport
+    return type(session)(base_url=session.base_url, headers=session.headers, timeout=session.timeout,
+                         follow_redirects=True, transport=transport)
+
+
+def _use_pooled_sessions(client, transport_class):
+    client.postgrest.session = _pooled_session(client.postgrest.session, transport_class(http2=True, limits=HTTP_LIMITS))
+    storage = client.storage
+    storage.session = storage._client = _pooled_session(storage.session, transport_class(http2=True, limits=HTTP_LIMITS))
+    return client
+
+
+def _check_credentials():
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in .env")
+
+
+def _create_client():
+    if DATA_BACKEND == "local":
+        from services.local_backend import LocalClient
+
+        return LocalClient()
+
+    from supabase import create_client
+
+    _check_credentials()
+    # create a supabase client using service role (server-only)
+    return _use_pooled_sessions(create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY), BreakerTransport)
+
+
+_client = PerProcess(_create_client)
+_http = PerProcess(lambda: pooled_http_client(timeout=httpx.Timeout(60.0, connect=10.0)))
+
+
+def get_supabase():
+    """This process's client, created on first use."""
+    return _client.get()
+
+
+def get_http() -> httpx.Client:
+    """Pooled client for raw Storage REST calls (streamed uploads)."""
+    return _http.get()
+
+
+_async_client = None
+_async_client_pid = None
+
+
+async def get_async_supabase():
+    """Async client for the ASGI serving mode (asgi.py), created on first use inside the event loop."""
+    global _async_client, _async_client_pid
+    if _async_client_pid != os.getpid():
+        if DATA_BACKEND == "local":
+            from services.local_backend import AsyncLocalClient
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-    raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in .env")
+            client = AsyncLocalClient(get_supabase())
+        else:
+            from supabase import acreate_client
 
-# create a supabase client using service role (server-only)
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+            _check_credentials()
+            client = _use_pooled_sessions(await acreate_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY),
+                                          AsyncBreakerTransport)
+        _async_client, _async_client_pid = client, os.getpid()
+    return _async_client
@@ -0,0 +1,318 @@
+# services/upload_queue.py
+import os
+import json
+import time
+import queue
+import random
+import logging
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from services.supabase_client import get_supabase
+from services.circuit import CircuitOpen
+from services.storage import upload_audio_file, decode_audio_base64, audio_digest, UPLOAD_CHUNK_SIZE
+from services.cache import invalidate_assessment
+from services.metrics import span, observe_size
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: no cross-process claim, single worker assumed
+    fcntl = None
+
+ASSESSMENTS_TABLE = os.getenv("ASSESSMENTS_TABLE", "voice_assessments")
+UPLOAD_MODE = os.getenv("AUDIO_UPLOAD_MODE", "async")
+SPOOL_DIR = os.getenv("AUDIO_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "echomind_audio_spool"))
+WORKERS = int(os.getenv("AUDIO_UPLOAD_WORKERS", 4))
+MAX_PENDING = int(os.getenv("AUDIO_UPLOAD_MAX_PENDING", 256))
+MAX_ATTEMPTS = int(os.getenv("AUDIO_UPLOAD_MAX_ATTEMPTS", 5))
+BACKOFF_SECONDS = float(os.getenv("AUDIO_UPLOAD_BACKOFF_SECONDS", 1.0))
+RESCAN_SECONDS = float(os.getenv("AUDIO_SPOOL_RESCAN_SECONDS", 30))
+# a recording spooled but never submitted this long ago was left by a crash
+ORPHAN_SECONDS = float(os.getenv("AUDIO_SPOOL_ORPHAN_SECONDS", 600))
+
+logger = logging.getLogger(__name__)
+
+
+class UploadQueue:
+    """
+    Background audio uploads backed by a local spool directory.
+
+    submit_test spools the recording to disk, inserts the row with status
+    "audio_pending" and then submits the id. Only submit() writes the meta
+    file, so a rescan never picks up a recording whose row does not exist. A bounded pool of worker threads
+    uploads each spooled file with retries and exponential backoff, then
+    patches audio_path/has_audio on the row. Spooled items that
+    were never uploaded (queue full, process restart) are picked up again
+    when a worker rescans the spool directory. A recording left without
+    meta for AUDIO_SPOOL_ORPHAN_SECONDS (a crash between spooling and
+    submit) is submitted if its row is still audio_pending, else deleted.
+    """
+
+    def __init__(self, spool_dir: str = SPOOL_DIR, workers: int = WORKERS):
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, "failed")
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    # ---- spooling ----
+
+    def _paths(self, aid: str):
+        return os.path.join(self.spool_dir, f"{aid}.audio"), os.path.join(self.spool_dir, f"{aid}.json")
+
+    def _write_meta(self, aid: str, content_type: str):
+        audio_path, meta_path = self._paths(aid)
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"id": aid, "content_type": content_type, "attempts": 0}, f)
+        os.replace(tmp, meta_path)
+
+    def spool_stream(self, aid: str, stream) -> bool:
+        """Copy a raw audio stream into the spool. Returns False if it was empty."""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        audio_path, _ = self._paths(aid)
+        tmp = audio_path + ".tmp"
+        size = 0
+        try:
+            with span("spool_write"), open(tmp, "wb") as f:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            # e.g. the body went over the size ceiling mid-read
+            os.unlink(tmp)
+            raise
+        observe_size("audio", size)
+        if size == 0:
+            os.unlink(tmp)
+            return False
+        os.replace(tmp, audio_path)
+        return True
+
+    def spool_base64(self, aid: str, audio_base64: str, expected_sha256: str = None) -> bool:
+        """Decode a base64 (optionally data:-prefixed) recording into the spool."""
+        if not audio_base64:
+            return False
+        audio_bytes = decode_audio_base64(audio_base64)
+        if expected_sha256:
+            audio_digest(audio_bytes, expected_sha256)
+        return self.spool_bytes(aid, audio_bytes)
+
+    def spool_bytes(self, aid: str, audio_bytes: bytes) -> bool:
+        if not audio_bytes:
+            return False
+        os.makedirs(self.spool_dir, exist_ok=True)
+        audio_path, _ = self._paths(aid)
+        # a retry of the same submission respools under the same id: swap the
+        # file in whole so a worker never hashes a half-written recording
+        tmp = audio_path + ".tmp"
+        with span("spool_write"), open(tmp, "wb") as f:
+            f.write(audio_bytes)
+        os.replace(tmp, audio_path)
+        return True
+
+    def spool_path(self, aid: str) -> str:
+        """Where aid's recording is spooled, for callers that move a finished file in themselves."""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        return self._paths(aid)[0]
+
+    def discard(self, aid: str):
+        for path in self._paths(aid):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    # ---- queue ----
+
+    def _ensure_started(self):
+        # threads do not survive fork, so start them per process on first use
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=MAX_PENDING)
+            self._queued = set()
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"audio-upload-{i}", daemon=True).start()
+        self.rescan()
+
+    def start(self):
+        """Start this process's workers and queue whatever an earlier process left in the spool."""
+        self._ensure_started()
+
+    def submit(self, aid: str, content_type: str = "audio/webm") -> bool:
+        """Mark a spooled recording as ready for upload and queue it."""
+        self._write_meta(aid, content_type)
+        return self.enqueue(aid)
+
+    def enqueue(self, aid: str) -> bool:
+        """Queue a spooled recording. If the queue is full it stays on disk for the next rescan."""
+        self._ensure_started()
+        with self._lock:
+            if aid in self._queued:
+                return True
+            try:
+                self._queue.put_nowait(aid)
+            except queue.Full:
+                return False
+            self._queued.add(aid)
+        return True
+
+    def rescan(self):
+        """Enqueue every spooled recording that is not already queued."""
+        try:
+            names = os.listdir(self.spool_dir)
+        except FileNotFoundError:
+            return
+        self._recover_orphans(names)
+        for name in names:
+            if name.endswith(".json"):
+                if not self.enqueue(name[:-len(".json")]):
+                    break
+
+    def _stale(self, name: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(os.path.join(self.spool_dir, name)) > ORPHAN_SECONDS
+        except FileNotFoundError:
+            return False
+
+    def _recover_orphans(self, names: list):
+        """
+        Deal with spool files a crashed request left behind: recordings whose
+        row is audio_pending get their meta written (the listing is updated so
+        rescan queues them), any other recording and stale .tmp files are removed.
+        """
+        listed = set(names)
+        for name in names:
+            if name.endswith(".tmp") and self._stale(name):
+                try:
+                    os.unlink(os.path.join(self.spool_dir, name))
+                except FileNotFoundError:
+                    pass
+        orphans = [name[:-len(".audio")] for name in names
+                   if name.endswith(".audio") and name[:-len(".audio")] + ".json" not in listed
+                   and self._stale(name)]
+        if not orphans:
+            return
+        try:
+            res = get_supabase().table(ASSESSMENTS_TABLE).select("id,status").in_("id", orphans).execute()
+        except Exception as e:
+            logger.warning("could not look up orphaned spool files, retrying next rescan: %s", e)
+            return
+        pending = {r["id"] for r in res.data or [] if r.get("status") == "audio_pending"}
+        for aid in orphans:
+            if aid in pending:
+                logger.warning("resubmitting orphaned spooled recording %s", aid)
+                # the content type was lost with the request; webm is what browsers record
+                self._write_meta(aid, "audio/webm")
+                names.append(f"{aid}.json")
+            else:
+                logger.warning("removing orphaned spooled recording %s (no pending row)", aid)
+                self.discard(aid)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            try:
+                aid = self._queue.get(timeout=RESCAN_SECONDS)
+            except queue.Empty:
+                self.rescan()
+                continue
+            try:
+                self._process(aid)
+            except Exception:
+                logger.exception("audio upload worker error for %s", aid)
+            finally:
+                with self._lock:
+                    self._queued.discard(aid)
+                self._queue.task_done()
+
+    def _process(self, aid: str):
+        audio_path, meta_path = self._paths(aid)
+        try:
+            meta_file = open(meta_path, "r+")
+        except FileNotFoundError:
+            return  # already handled by another worker
+        with meta_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(meta_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return  # claimed by another process
+            if not os.path.exists(meta_path):
+                return
+            meta = json.load(meta_file)
+
+            outcome = None
+            while outcome is None:
+                try:
+                    self._upload_and_patch(aid, audio_path, meta.get("content_type") or "audio/webm")
+                    outcome = "done"
+                except CircuitOpen as e:
+                    # Supabase is known to be down: wait it out without using up an attempt
+                    time.sleep(e.retry_after)
+                except Exception as e:
+                    meta["attempts"] = meta.get("attempts", 0) + 1
+                    logger.warning("audio upload attempt %d failed for %s: %s", meta["attempts"], aid, e)
+                    meta_file.seek(0)
+                    meta_file.truncate()
+                    json.dump(meta, meta_file)
+                    meta_file.flush()
+                    if meta["attempts"] >= MAX_ATTEMPTS:
+                        outcome = "failed"
+                    else:
+                        delay = min(60.0, BACKOFF_SECONDS * (2 ** (meta["attempts"] - 1)))
+                        time.sleep(delay + random.uniform(0, delay / 2))
+
+            if fcntl is not None:
+                # remove the files while still holding the claim, or another
+                # process's rescan could claim them between close and unlink
+                self._finish(aid, outcome)
+                return
+        # Windows cannot unlink open files (and has no cross-process claim)
+        self._finish(aid, outcome)
+
+    def _finish(self, aid: str, outcome: str):
+        if outcome == "done":
+            self.discard(aid)
+        else:
+            self._give_up(aid)
+
+    def _upload_and_patch(self, aid: str, audio_path: str, content_type: str):
+        storage_path = upload_audio_file(audio_path, content_type)
+        get_supabase().table(ASSESSMENTS_TABLE).update({
+            "audio_path": storage_path,
+            "has_audio": bool(storage_path),
+            "status": "submitted",
+            "updated_at": datetime.utcnow().isoformat()
+        }).eq("id", aid).execute()
+        invalidate_assessment(aid)
+
+    def _give_up(self, aid: str):
+        # keep the recording for manual recovery rather than dropping it
+        os.makedirs(self.failed_dir, exist_ok=True)
+        for path in self._paths(aid):
+            if os.path.exists(path):
+                shutil.move(path, os.path.join(self.failed_dir, os.path.basename(path)))
+        try:
+            get_supabase().table(ASSESSMENTS_TABLE).update({
+                "status": "audio_failed",
+                "updated_at": datetime.utcnow().isoformat()
+            }).eq("id", aid).execute()
+            invalidate_assessment(aid)
+        except Exception:
+            logger.exception("could not mark %s audio_failed", aid)
+
+
+upload_queue = UploadQueue()
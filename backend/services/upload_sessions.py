@@ -0,0 +1,209 @@
+# services/upload_sessions.py
+"""
+Resumable audio uploads for clients on unreliable networks.
+
+    POST  /api/uploads                   open a session -> {"uploadId", "offset": 0}
+    PATCH /api/uploads/<id>              append the body at the Upload-Offset header
+    HEAD  /api/uploads/<id>              current Upload-Offset (after a dropped connection)
+    POST  /api/uploads/<id>/finalize     seal it; returns the recording's sha256
+
+The finalized uploadId is then sent to submit_test as audioUploadId instead
+of audioData. Chunks go straight to a file in UPLOAD_SESSION_DIR, so a chunk
+cut off mid-way keeps the bytes that arrived and the client resumes from the
+offset HEAD reports. Sessions idle for longer than UPLOAD_SESSION_TTL_SECONDS
+are removed by a sweep that runs at most every UPLOAD_SESSION_SWEEP_SECONDS.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from services.admission import SUBMIT_MAX_BYTES, PayloadTooLarge
+from services.storage import UPLOAD_CHUNK_SIZE
+from services.metrics import span, observe_size
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: appends are not locked across processes
+    fcntl = None
+
+SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", os.path.join(tempfile.gettempdir(), "echomind_upload_sessions"))
+SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL_SECONDS", 24 * 3600))
+SWEEP_INTERVAL = float(os.getenv("UPLOAD_SESSION_SWEEP_SECONDS", 600))
+
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+logger = logging.getLogger(__name__)
+
+
+class UploadNotFound(Exception):
+    pass
+
+
+class OffsetMismatch(Exception):
+    """The client's Upload-Offset is not where the session ends (or another append is running)."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"current offset is {offset}")
+        self.offset = offset
+
+
+class UploadIncomplete(Exception):
+    """Appending to a finalized session, or using one that is not finalized (or short of its length)."""
+
+
+class UploadSessions:
+    def __init__(self, root: str = SESSION_DIR):
+        self.root = root
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _paths(self, sid: str):
+        if not SESSION_ID.match(sid or ""):
+            raise UploadNotFound()
+        return os.path.join(self.root, f"{sid}.part"), os.path.join(self.root, f"{sid}.json")
+
+    def data_path(self, sid: str) -> str:
+        return self._paths(sid)[0]
+
+    def _write_meta(self, meta: dict):
+        _, meta_path = self._paths(meta["id"])
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def get(self, sid: str) -> dict:
+        _, meta_path = self._paths(sid)
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadNotFound()
+
+    def create(self, content_type: str = "audio/webm", length: int = None) -> dict:
+        if length is not None and length > SUBMIT_MAX_BYTES:
+            raise PayloadTooLarge(SUBMIT_MAX_BYTES)
+        self.sweep()
+        os.makedirs(self.root, exist_ok=True)
+        meta = {"id": uuid.uuid4().hex, "content_type": content_type, "length": length, "offset": 0,
+                "sha256": None, "created_at": time.time()}
+        open(self._paths(meta["id"])[0], "wb").close()
+        self._write_meta(meta)
+        return meta
+
+    def append(self, sid: str, offset: int, stream) -> dict:
+        """
+        Write the stream at offset. Bytes that arrive before the stream breaks
+        are kept and counted, so the client can resume from the new offset.
+        """
+        data_path, _ = self._paths(sid)
+        try:
+            f = open(data_path, "r+b")
+        except FileNotFoundError:
+            raise UploadNotFound()
+        with f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # an earlier attempt of this chunk is still being received
+                    raise OffsetMismatch(self.get(sid)["offset"])
+            meta = self.get(sid)
+            if meta["sha256"]:
+                raise UploadIncomplete()
+            if offset != meta["offset"]:
+                raise OffsetMismatch(meta["offset"])
+            limit = min(SUBMIT_MAX_BYTES, meta["length"] or SUBMIT_MAX_BYTES)
+
+            f.seek(offset)
+            f.truncate()
+            written = 0
+            try:
+                with span("session_write"):
+                    while True:
+                        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if offset + written + len(chunk) > limit:
+                            f.truncate(offset)
+                            written = 0
+                            raise PayloadTooLarge(limit)
+                        f.write(chunk)
+                        written += len(chunk)
+            finally:
+                f.flush()
+                observe_size("audio_chunk", written)
+                if written:
+                    meta["offset"] = offset + written
+                    self._write_meta(meta)
+        return meta
+
+    def finalize(self, sid: str, expected_sha256: str = None) -> dict:
+        """Seal the session and record the recording's hash. Idempotent."""
+        meta = self.get(sid)
+        if meta["sha256"]:
+            return meta
+        if not meta["offset"] or (meta["length"] is not None and meta["offset"] != meta["length"]):
+            raise UploadIncomplete()
+        data_path, _ = self._paths(sid)
+        digest = hashlib.sha256()
+        with span("sha256"), open(data_path, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            raise ValueError("sha256 mismatch")
+        meta["sha256"] = digest.hexdigest()
+        self._write_meta(meta)
+        return meta
+
+    def finalized(self, sid: str) -> dict:
+        """Metadata of a finalized session, for submit_test."""
+        meta = self.get(sid)
+        if not meta["sha256"]:
+            raise UploadIncomplete()
+        return meta
+
+    def move_data(self, sid: str, dest: str):
+        """Hand the recording over to another owner (the upload queue's spool)."""
+        shutil.move(self.data_path(sid), dest)
+
+    def discard(self, sid: str):
+        for path in self._paths(sid):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self, force: bool = False):
+        """Remove sessions idle (by file mtime) for longer than UPLOAD_SESSION_TTL_SECONDS."""
+        if not force and time.monotonic() - self._last_sweep < SWEEP_INTERVAL:
+            return
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sweep = time.monotonic()
+            try:
+                names = os.listdir(self.root)
+            except FileNotFoundError:
+                return
+            cutoff = time.time() - SESSION_TTL
+            for name in names:
+                path = os.path.join(self.root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("could not remove stale upload %s: %s", name, e)
+        finally:
+            self._sweep_lock.release()
+
+
+upload_sessions = UploadSessions()
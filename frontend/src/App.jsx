@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useReducer } from 'react';
+import React, { useState, useEffect, useReducer, useRef } from 'react';
 import Header from './components/Header';
 import StatsGrid from './components/StatsGrid';
 import ChartsSection from './components/ChartsSection';
@@ -6,6 +6,9 @@ import TestCard from './components/TestCard';
 import TestModal from './components/TestModal';
 
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:5000';
+const MAX_SUBMIT_RETRIES = 3;
+const UPLOAD_CHUNK_BYTES = 256 * 1024;
+const MAX_CHUNK_RETRIES = 5;
 
 // ---------------------------
 // INITIAL STATES
@@ -74,12 +77,39 @@ function App() {
   const [mediaRecorder, setMediaRecorder] = useState(null);
   const [submitting, setSubmitting] = useState(false);
   const [testResult, setTestResult] = useState(null);
+  // one key per submission: a retry after a dropped response returns the original result
+  const idempotencyKey = useRef(null);
+  // true while /api/stats/stream is delivering updates
+  const liveStats = useRef(false);
 
   // ---------------------------
-  // FETCH DASHBOARD STATS
+  // LIVE DASHBOARD STATS
   // ---------------------------
+  // a snapshot on connect, then only the fields that changed; falls back to
+  // one-off fetches where the stream is unavailable
   useEffect(() => {
-    fetchStats();
+    if (typeof EventSource === 'undefined') {
+      fetchStats();
+      return undefined;
+    }
+    const source = new EventSource(`${API_BASE_URL}/api/stats/stream`);
+    source.addEventListener('snapshot', (e) => {
+      liveStats.current = true;
+      setStats(JSON.parse(e.data));
+      setLoading(false);
+    });
+    source.addEventListener('delta', (e) => {
+      const delta = JSON.parse(e.data);
+      setStats((prev) => ({ ...prev, ...delta }));
+    });
+    source.onerror = () => {
+      // the browser reconnects by itself unless the server refused the stream
+      if (source.readyState === EventSource.CLOSED) {
+        liveStats.current = false;
+        fetchStats();
+      }
+    };
+    return () => source.close();
   }, []);
 
   const fetchStats = async () => {
@@ -125,13 +155,65 @@ function App() {
     }
   };
 
-  const blobToBase64 = (blob) => {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.onloadend = () => resolve(reader.result.split(',')[1]);
-      reader.onerror = reject;
-      reader.readAsDataURL(blob);
+  const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+  // resumable upload: after a dropped chunk, ask the server how far it got and continue from there
+  const uploadRecording = async (blob, sha256) => {
+    const created = await fetch(`${API_BASE_URL}/api/uploads`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ contentType: blob.type || 'audio/webm', length: blob.size })
     });
+    if (!created.ok) throw new Error('Could not start the audio upload');
+    const { uploadId } = await created.json();
+    const uploadUrl = `${API_BASE_URL}/api/uploads/${uploadId}`;
+
+    let offset = 0;
+    let failures = 0;
+    while (offset < blob.size) {
+      try {
+        const response = await fetch(uploadUrl, {
+          method: 'PATCH',
+          headers: { 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': String(offset) },
+          body: blob.slice(offset, offset + UPLOAD_CHUNK_BYTES)
+        });
+        const serverOffset = response.headers.get('Upload-Offset');
+        // 409: our offset was stale, the server tells us where to continue
+        if ((!response.ok && response.status !== 409) || serverOffset === null) {
+          throw new Error(`Audio upload failed (${response.status})`);
+        }
+        offset = Number(serverOffset);
+        failures = 0;
+      } catch (error) {
+        if (++failures > MAX_CHUNK_RETRIES) throw error;
+        await sleep(1000 * 2 ** (failures - 1));
+        const head = await fetch(uploadUrl, { method: 'HEAD' }).catch(() => null);
+        if (head && head.ok) offset = Number(head.headers.get('Upload-Offset'));
+      }
+    }
+
+    const finalized = await fetch(`${uploadUrl}/finalize`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ sha256 })
+    });
+    if (!finalized.ok) throw new Error('Could not finish the audio upload');
+    return uploadId;
+  };
+
+  const blobSha256 = async (blob) => {
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+  };
+
+  // true when an earlier attempt already stored this recording
+  const audioAlreadyStored = async (sha256) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/audio/${sha256}`);
+      return response.ok && (await response.json()).exists;
+    } catch {
+      return false;
+    }
   };
 
   // ---------------------------
@@ -144,8 +226,10 @@ function App() {
     }
 
     setSubmitting(true);
+    if (!idempotencyKey.current) idempotencyKey.current = crypto.randomUUID();
     try {
-      const audioBase64 = await blobToBase64(audioBlob);
+      const audioSha256 = await blobSha256(audioBlob);
+      const audioStored = await audioAlreadyStored(audioSha256);
 
       const payload = {
         fullName: formData.fullName || null,
@@ -165,23 +249,32 @@ function App() {
         question7: parseInt(formData.question7),
         question8: parseInt(formData.question8),
 
-        // Consent + Audio
+        // Consent + Audio (uploaded in resumable chunks unless the server already has it)
         consentData: consentData,
-        audioData: `data:audio/webm;base64,${audioBase64}`
+        audioSha256: audioSha256,
+        ...(audioStored ? {} : { audioUploadId: await uploadRecording(audioBlob, audioSha256) })
       };
 
-      const response = await fetch(`${API_BASE_URL}/api/submit_test`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload)
-      });
+      const body = JSON.stringify(payload);
+      let response;
+      for (let attempt = 0; ; attempt++) {
+        response = await fetch(`${API_BASE_URL}/api/submit_test`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey.current },
+          body
+        });
+        // server busy: wait as asked and resend (safe, the idempotency key dedupes)
+        if (response.status !== 503 || attempt >= MAX_SUBMIT_RETRIES) break;
+        const retryAfter = Number(response.headers.get('Retry-After')) || 2;
+        await sleep(retryAfter * 1000);
+      }
 
       const result = await response.json();
       if (!response.ok) throw new Error(result.error || 'Submission failed');
 
       setTestResult(result);
       setStep(3);
-      fetchStats();
+      if (!liveStats.current) fetchStats();
     } catch (error) {
       console.error('Error submitting test:', error);
       alert('Failed to submit test. Please try again.');
@@ -202,6 +295,7 @@ function App() {
     setIsRecording(false);
     setMediaRecorder(null);
     setTestResult(null);
+    idempotencyKey.current = null;
   };
 
   const handleNext = () => {